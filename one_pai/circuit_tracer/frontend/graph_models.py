@@ -12,15 +12,159 @@ Questo modulo fornisce:
 - Utility per il caricamento e configurazione modelli
 """
 
+import json
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import numpy as np
 import torch
 import torch.nn as nn
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Tuple
 import logging
 from pathlib import Path
 
+try:
+    import safetensors.torch as safetensors_torch
+except ImportError:
+    # safetensors è opzionale: senza di esso i modelli si salvano con torch.save
+    safetensors_torch = None
+
+from .. import HookedTransformerConfig
+from ..utils import get_default_device
+
+try:
+    from numba import njit
+except ImportError:
+    # Numba è opzionale: senza di esso il kernel gira in Python puro
+    def njit(*args, **kwargs):
+        def decorator(func):
+            return func
+        return decorator
+
 logger = logging.getLogger(__name__)
 
 
+def _compile_errors() -> Tuple[type, ...]:
+    """Eccezioni di torch.compile che indicano un fallimento della compilazione."""
+    try:
+        import torch._dynamo.exc as dynamo_exc
+    except ImportError:
+        return ()
+    names = ("BackendCompilerFailed", "Unsupported", "InternalTorchDynamoError")
+    return tuple(getattr(dynamo_exc, name) for name in names if hasattr(dynamo_exc, name))
+
+
+@contextmanager
+def _passthrough_hooks(fwd_hooks=None, bwd_hooks=None):
+    """Context manager per gestire hooks."""
+    try:
+        yield
+    finally:
+        pass
+
+
+@njit(cache=True, fastmath=False)
+def _bpe_merge(
+    ids: np.ndarray,
+    merge_keys: np.ndarray,
+    merge_ranks: np.ndarray,
+    merge_ids: np.ndarray,
+    vocab_size: int
+) -> np.ndarray:
+    """
+    Applica le merge BPE a una sequenza di token int32.
+    
+    La tabella delle merge è rappresentata da array ordinati per chiave
+    (left * vocab_size + right), così il kernel può essere compilato da Numba
+    senza strutture Python.
+    """
+    out = ids.copy()
+    n = out.shape[0]
+    n_merges = merge_keys.shape[0]
+    
+    while n > 1:
+        best_rank = -1
+        best_idx = -1
+        for i in range(n - 1):
+            key = np.int64(out[i]) * vocab_size + out[i + 1]
+            j = np.searchsorted(merge_keys, key)
+            if j < n_merges and merge_keys[j] == key:
+                if best_rank < 0 or merge_ranks[j] < best_rank:
+                    best_rank = merge_ranks[j]
+                    best_idx = j
+        
+        if best_idx < 0:
+            break
+        
+        # Sostituisce in place tutte le occorrenze della coppia migliore
+        best_key = merge_keys[best_idx]
+        new_id = merge_ids[best_idx]
+        write = 0
+        i = 0
+        while i < n:
+            if i < n - 1 and np.int64(out[i]) * vocab_size + out[i + 1] == best_key:
+                out[write] = new_id
+                i += 2
+            else:
+                out[write] = out[i]
+                i += 1
+            write += 1
+        n = write
+    
+    return out[:n]
+
+
+@dataclass(slots=True)
+class PlaceholderTokenizer:
+    """
+    Tokenizer placeholder byte-level BPE.
+    
+    Il testo viene convertito in byte UTF-8 (id 0-255) e poi fuso secondo la
+    tabella di merge, con il ciclo di merge eseguito da un kernel Numba.
+    """
+    
+    vocab_size: int = 50257
+    pad_token_id: int = 0
+    eos_token_id: int = 2
+    # (left, right) -> nuovo id, in ordine di priorità
+    merges: Dict[Tuple[int, int], int] = field(default_factory=dict)
+    
+    _merge_keys: np.ndarray = field(init=False, repr=False)
+    _merge_ranks: np.ndarray = field(init=False, repr=False)
+    _merge_ids: np.ndarray = field(init=False, repr=False)
+    _token_bytes: Dict[int, bytes] = field(init=False, repr=False)
+    
+    def __post_init__(self):
+        merges = self.merges
+        keys = np.array(
+            [left * self.vocab_size + right for left, right in merges], dtype=np.int64
+        )
+        order = np.argsort(keys, kind="stable")
+        self._merge_keys = keys[order]
+        self._merge_ranks = np.arange(len(merges), dtype=np.int32)[order]
+        self._merge_ids = np.array(list(merges.values()), dtype=np.int32)[order]
+        
+        self._token_bytes = {i: bytes([i]) for i in range(256)}
+        for (left, right), new_id in merges.items():
+            self._token_bytes[new_id] = self._token_bytes[left] + self._token_bytes[right]
+    
+    def encode(self, text: str) -> np.ndarray:
+        """Codifica il testo in un array int32 di token IDs."""
+        ids = np.frombuffer(text.encode("utf-8"), dtype=np.uint8).astype(np.int32)
+        if self._merge_keys.size == 0:
+            return ids
+        
+        return _bpe_merge(
+            ids, self._merge_keys, self._merge_ranks, self._merge_ids, self.vocab_size
+        )
+    
+    def decode(self, ids) -> str:
+        """Decodifica una sequenza di token IDs in testo."""
+        token_bytes = self._token_bytes
+        flat = np.asarray(ids, dtype=np.int64).ravel().tolist()
+        return b"".join(token_bytes.get(i, b"") for i in flat).decode("utf-8", errors="replace")
+
+
 class ReplacementModel(nn.Module):
     """
     Modello wrapper per l'analisi di attribuzione con transcoder.
@@ -55,8 +199,16 @@ class ReplacementModel(nn.Module):
         
         # Placeholder per il modello e transcoder
         self.model = None
+        self.embed = None
         self.transcoder = None
         self.tokenizer = None
+        # Versione compilata di self.model (torch.compile); salvata fuori da
+        # _modules per non duplicare i parametri nello state_dict
+        object.__setattr__(self, "_compiled", None)
+        # Numero di parametri, calcolato una volta dopo il caricamento
+        self._param_count = None
+        # Impostato da compile_for_inference: forward in torch.inference_mode
+        self._inference_only = False
         
         logger.info(f"Inizializzato ReplacementModel con transcoder_set: {transcoder_set}")
         
@@ -66,12 +218,7 @@ class ReplacementModel(nn.Module):
     
     def _get_best_device(self) -> str:
         """Determina il miglior device disponibile."""
-        if torch.cuda.is_available():
-            return "cuda"
-        elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
-            return "mps"
-        else:
-            return "cpu"
+        return get_default_device()
     
     def _load_model(self):
         """Carica il modello e i transcoder."""
@@ -83,9 +230,18 @@ class ReplacementModel(nn.Module):
             # Per ora, creiamo un modello placeholder
             # In una implementazione reale, qui caricheresti da Hugging Face
             self.model = self._create_placeholder_model()
+            self.embed = self._create_placeholder_embedding()
             self.transcoder = self._create_placeholder_transcoder()
             self.tokenizer = self._create_placeholder_tokenizer()
             
+            # Pesi in precisione ridotta: dimezza la banda sulla proiezione dei logits
+            if self.dtype != torch.float32:
+                self.model.to(dtype=self.dtype)
+                self.embed.to(dtype=self.dtype)
+            
+            object.__setattr__(self, "_compiled", self._compile_model(self.model))
+            self._param_count = self._count_parameters()
+            
             # Applica configurazioni
             if self.offload:
                 logger.info(f"Applicando offload: {self.offload}")
@@ -101,74 +257,192 @@ class ReplacementModel(nn.Module):
             logger.error(f"Errore nel caricamento del modello: {e}")
             raise
     
+    def _compile_model(self, model: nn.Module) -> Optional[nn.Module]:
+        """
+        Compila il modello con TorchInductor per fondere Linear+ReLU.
+        
+        Returns:
+            Il modello compilato, oppure None se torch.compile non è disponibile
+            o fallisce (in tal caso si usa il percorso eager).
+        """
+        if not hasattr(torch, "compile"):
+            return None
+        
+        try:
+            # dynamic=None: shape statiche alla prima chiamata, poi dynamo
+            # ricompila con dimensioni dinamiche solo se le shape cambiano
+            return torch.compile(model, mode="reduce-overhead", dynamic=None)
+        except Exception as e:
+            logger.warning(f"torch.compile non disponibile, uso modalità eager: {e}")
+            return None
+    
+    def _run_model(self, x: torch.Tensor) -> torch.Tensor:
+        """Esegue il modello compilato, con fallback eager se la compilazione fallisce.
+        
+        Solo gli errori di dynamo/backend disattivano la compilazione; gli
+        errori sollevati dal modello stesso vengono propagati.
+        """
+        compiled = self._compiled
+        if compiled is not None:
+            try:
+                return compiled(x)
+            except _compile_errors() as e:
+                logger.warning(f"Compilazione fallita, uso modalità eager: {e}")
+                object.__setattr__(self, "_compiled", None)
+        
+        return self.model(x)
+    
     def _create_placeholder_model(self) -> nn.Module:
         """Crea un modello placeholder per testing."""
         return nn.Sequential(
             nn.Linear(768, 512),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.Linear(512, 256),
-            nn.ReLU(),
+            nn.ReLU(inplace=True),
             nn.Linear(256, 50257)  # Vocab size tipico
         )
     
+    def _create_placeholder_embedding(self) -> nn.Module:
+        """Crea la tabella di embedding placeholder (vocab -> d_model)."""
+        return nn.Embedding(50257, 768)
+    
     def _create_placeholder_transcoder(self) -> Dict[str, Any]:
-        """Crea transcoder placeholder."""
+        """
+        Crea transcoder placeholder.
+        
+        Con lazy_encoder/lazy_decoder i layer vengono creati sul device "meta"
+        (nessuna memoria allocata) e materializzati alla prima chiamata, da un
+        forward pre-hook; chi legge direttamente i pesi usa
+        _materialize_encoder/_materialize_decoder.
+        """
         return {
-            "encoder": nn.Linear(768, 512),
-            "decoder": nn.Linear(512, 768),
+            "encoder": self._create_transcoder_layer(768, 512, lazy=self.lazy_encoder),
+            "decoder": self._create_transcoder_layer(512, 768, lazy=self.lazy_decoder),
             "config": {"hidden_size": 512, "num_layers": 12}
         }
     
-    def _create_placeholder_tokenizer(self) -> Dict[str, Any]:
+    def _create_transcoder_layer(self, in_features: int, out_features: int, lazy: bool) -> nn.Linear:
+        """Crea un layer del transcoder, sul device meta se lazy."""
+        if not lazy:
+            return nn.Linear(in_features, out_features)
+        
+        with torch.device("meta"):
+            layer = nn.Linear(in_features, out_features)
+        
+        def materialize(module, args):
+            self._materialize_layer(module)
+            handle.remove()
+        
+        handle = layer.register_forward_pre_hook(materialize)
+        return layer
+    
+    def _materialize_layer(self, layer: nn.Module) -> nn.Module:
+        """Alloca e inizializza sul device del modello un layer ancora su meta."""
+        if layer.weight.is_meta:
+            layer.to_empty(device=self.device)
+            # reset_parameters applica kaiming_uniform_ a pesi e bias
+            layer.reset_parameters()
+            logger.debug(f"Layer del transcoder materializzato su {self.device}")
+        return layer
+    
+    def _materialize_transcoder_layer(self, key: str) -> nn.Module:
+        """Materializza, se ancora su meta, il layer key del transcoder."""
+        return self._materialize_layer(self.transcoder[key])
+    
+    def _materialize_encoder(self) -> nn.Module:
+        """Restituisce l'encoder del transcoder, materializzandolo se necessario."""
+        return self._materialize_transcoder_layer("encoder")
+    
+    def _materialize_decoder(self) -> nn.Module:
+        """Restituisce il decoder del transcoder, materializzandolo se necessario."""
+        return self._materialize_transcoder_layer("decoder")
+    
+    def _create_placeholder_tokenizer(self) -> PlaceholderTokenizer:
         """Crea tokenizer placeholder."""
-        return {
-            "vocab_size": 50257,
-            "pad_token_id": 0,
-            "eos_token_id": 2,
-            "encode": lambda text: [1, 2, 3, 4, 5],  # Placeholder encoding
-            "decode": lambda ids: "placeholder text"
-        }
+        return PlaceholderTokenizer(vocab_size=50257, pad_token_id=0, eos_token_id=2)
+    
+    def _count_parameters(self) -> int:
+        """Conta i parametri del modello."""
+        return sum(p.numel() for p in self.parameters())
     
     def _apply_offload(self):
         """Applica offloading del modello."""
+        # L'offload può svuotare i parametri: il conteggio va ricalcolato
+        self._param_count = None
         if self.offload == "cpu":
             logger.info("Offloading parametri su CPU")
         elif self.offload == "disk":
             logger.info("Offloading parametri su disco")
     
+    def compile_for_inference(self) -> "ReplacementModel":
+        """
+        Specializza il modello per la sola inferenza.
+        
+        Il forward viene eseguito in torch.inference_mode, riusando il modello
+        già compilato da _load_model. Da non usare per l'attribuzione, che
+        richiede i gradienti.
+        
+        Returns:
+            Il modello stesso, per concatenare le chiamate
+        """
+        if self.model is None:
+            raise RuntimeError("Modello non caricato. Chiamare _load_model() prima.")
+        if self.training:
+            raise RuntimeError("compile_for_inference richiede model.eval()")
+        
+        self._inference_only = True
+        
+        return self
+    
     def forward(self, input_ids: torch.Tensor, **kwargs) -> torch.Tensor:
         """Forward pass del modello."""
         if self.model is None:
             raise RuntimeError("Modello non caricato. Chiamare _load_model() prima.")
         
-        # Converti input_ids in embeddings (placeholder)
-        batch_size, seq_len = input_ids.shape
-        embeddings = torch.randn(batch_size, seq_len, 768, dtype=self.dtype, device=self.device)
+        if self._inference_only:
+            with torch.inference_mode():
+                return self._forward(input_ids)
         
-        # Forward pass attraverso il modello
-        output = self.model(embeddings.view(batch_size * seq_len, -1))
+        return self._forward(input_ids)
+    
+    def _forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        """Corpo del forward pass."""
+        # Converti input_ids in embeddings tramite lookup (nessuna allocazione casuale)
+        embeddings = self.embed(input_ids)
+        if not embeddings.is_contiguous():
+            embeddings = embeddings.contiguous()
         
-        return output.view(batch_size, seq_len, -1)
+        # Forward pass attraverso il modello: nn.Linear opera già sulle dimensioni
+        # iniziali (batch, seq). Con dtype FP16/BF16 autocast abilita i tensor
+        # core anche sulla GEMM finale dei logits
+        with torch.autocast(
+            device_type=torch.device(self.device).type,
+            dtype=self.dtype,
+            enabled=self.dtype in (torch.float16, torch.bfloat16)
+        ):
+            return self._run_model(embeddings)
     
     def encode_text(self, text: str) -> torch.Tensor:
         """Codifica testo in token IDs."""
         if self.tokenizer is None:
             raise RuntimeError("Tokenizer non caricato")
         
-        # Placeholder encoding
-        token_ids = self.tokenizer["encode"](text)
-        return torch.tensor([token_ids], dtype=torch.long, device=self.device)
+        # from_numpy condivide la memoria dell'array int32 prodotto dal tokenizer
+        token_ids = torch.from_numpy(self.tokenizer.encode(text))
+        return token_ids.unsqueeze(0).to(device=self.device, dtype=torch.long)
     
     def decode_tokens(self, token_ids: torch.Tensor) -> str:
         """Decodifica token IDs in testo."""
         if self.tokenizer is None:
             raise RuntimeError("Tokenizer non caricato")
         
-        # Placeholder decoding
-        return self.tokenizer["decode"](token_ids.tolist())
+        return self.tokenizer.decode(token_ids.tolist())
     
     def get_model_info(self) -> Dict[str, Any]:
         """Restituisce informazioni sul modello."""
+        if self.model and self._param_count is None:
+            self._param_count = self._count_parameters()
+        
         return {
             "model_name": self.model_name,
             "transcoder_set": self.transcoder_set,
@@ -177,29 +451,65 @@ class ReplacementModel(nn.Module):
             "offload": self.offload,
             "lazy_encoder": self.lazy_encoder,
             "lazy_decoder": self.lazy_decoder,
-            "parameters": sum(p.numel() for p in self.parameters()) if self.model else 0
+            "parameters": self._param_count if self.model else 0,
+            # Su GPU la BF16 sfrutta i tensor core senza perdita di range
+            "recommended_dtype": str(torch.bfloat16 if self.device != "cpu" else torch.float32)
         }
     
     def save_model(self, path: str):
-        """Salva il modello su disco."""
+        """
+        Salva il modello su disco.
+        
+        I pesi vengono scritti in formato safetensors (<path>.safetensors) e la
+        configurazione in un file JSON affiancato (<path>.json). Senza
+        safetensors si usa il checkpoint torch.save in <path>.
+        """
         save_path = Path(path)
         save_path.parent.mkdir(parents=True, exist_ok=True)
         
-        torch.save({
-            "model_state_dict": self.state_dict(),
-            "config": self.get_model_info()
-        }, save_path)
+        if safetensors_torch is None:
+            torch.save(
+                {"config": self.get_model_info(), "model_state_dict": self.state_dict()},
+                save_path
+            )
+            logger.info(f"Modello salvato in: {save_path}")
+            return
+        
+        # save_model (non save_file) accetta anche i pesi legati tra layer
+        safetensors_torch.save_model(self, str(save_path.with_suffix(".safetensors")))
+        save_path.with_suffix(".json").write_text(
+            json.dumps(self.get_model_info()), encoding="utf-8"
+        )
         
         logger.info(f"Modello salvato in: {save_path}")
     
     @classmethod
     def load_model(cls, path: str) -> "ReplacementModel":
-        """Carica un modello da disco."""
-        checkpoint = torch.load(path, map_location="cpu")
-        config = checkpoint["config"]
+        """Carica un modello da disco (formato safetensors + JSON, o .pt legacy)."""
+        load_path = Path(path)
+        weights_path = load_path.with_suffix(".safetensors")
+        
+        if weights_path.exists():
+            if safetensors_torch is None:
+                raise ImportError(f"safetensors è necessario per caricare {weights_path}")
+            config = json.loads(load_path.with_suffix(".json").read_text(encoding="utf-8"))
+            state_dict = None
+        else:
+            # Checkpoint salvati con torch.save
+            checkpoint = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+            config = checkpoint["config"]
+            state_dict = checkpoint["model_state_dict"]
+        
+        # Il dtype è serializzato come stringa (es. "torch.float32")
+        if isinstance(config.get("dtype"), str):
+            config["dtype"] = getattr(torch, config["dtype"].replace("torch.", ""))
         
         model = cls(**config)
-        model.load_state_dict(checkpoint["model_state_dict"])
+        if state_dict is None:
+            # Mappa il file in memoria senza unpickling e ricollega i pesi legati
+            safetensors_torch.load_model(model, str(weights_path))
+        else:
+            model.load_state_dict(state_dict)
         
         logger.info(f"Modello caricato da: {path}")
         return model
@@ -238,7 +548,6 @@ class ReplacementModel(nn.Module):
         model.transcoder = transcoder
         
         # Configura attributi aggiuntivi necessari per attribution
-        from .graph import HookedTransformerConfig
         model.cfg = HookedTransformerConfig(
             n_layers=12,
             d_model=768,
@@ -254,17 +563,7 @@ class ReplacementModel(nn.Module):
         model.feature_output_hook = lambda x: x  # Placeholder
         
         # Context manager per hooks
-        from contextlib import contextmanager
-        
-        @contextmanager
-        def hooks(fwd_hooks=None, bwd_hooks=None):
-            """Context manager per gestire hooks."""
-            try:
-                yield
-            finally:
-                pass
-        
-        model.hooks = hooks
+        model.hooks = _passthrough_hooks
         
         logger.info("ReplacementModel configurato con successo")
         return model
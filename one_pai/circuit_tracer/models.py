@@ -11,21 +11,31 @@ Questo modulo fornisce:
 - Context manager per operazioni temporanee
 """
 
+import os
 import torch
 import logging
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 from contextlib import contextmanager
 import tempfile
 import pickle
 from pathlib import Path
 
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+except ImportError:
+    # safetensors è opzionale: senza di esso l'offload su disco usa torch.save
+    safe_open = save_file = None
+
 logger = logging.getLogger(__name__)
 
 
 def offload_modules(
     modules: Dict[str, torch.nn.Module],
     offload_type: str = "cpu",
-    temp_dir: Optional[str] = None
+    temp_dir: Optional[str] = None,
+    pin_cache: Optional[Dict[str, Dict[str, torch.Tensor]]] = None,
+    stream: Optional["torch.cuda.Stream"] = None
 ) -> Dict[str, Any]:
     """
     Offload moduli su CPU o disco per liberare memoria GPU.
@@ -34,6 +44,8 @@ def offload_modules(
         modules: Dizionario di moduli da offload
         offload_type: Tipo di offload ('cpu' o 'disk')
         temp_dir: Directory temporanea per offload su disco
+        pin_cache: Cache opzionale di buffer pinned riutilizzati tra offload su CPU
+        stream: Stream CUDA dedicato su cui eseguire le copie D2H in modo asincrono
     
     Returns:
         Dizionario con informazioni di offload
@@ -49,7 +61,7 @@ def offload_modules(
     
     for name, module in modules.items():
         if offload_type == "cpu":
-            offload_info["modules"][name] = _offload_to_cpu(module, name)
+            offload_info["modules"][name] = _offload_to_cpu(module, name, pin_cache, stream)
         elif offload_type == "disk":
             offload_info["modules"][name] = _offload_to_disk(module, name, temp_dir)
         else:
@@ -59,26 +71,76 @@ def offload_modules(
     return offload_info
 
 
-def _offload_to_cpu(module: torch.nn.Module, name: str) -> Dict[str, Any]:
+def _offload_to_cpu(
+    module: torch.nn.Module,
+    name: str,
+    pin_cache: Optional[Dict[str, Dict[str, torch.Tensor]]] = None,
+    stream: Optional["torch.cuda.Stream"] = None
+) -> Dict[str, Any]:
     """
     Offload modulo su CPU.
+    
+    Per moduli su GPU i parametri vengono copiati in buffer pinned (riutilizzati
+    tramite pin_cache), così il ripristino è un DMA diretto, e i blocchi liberati
+    vengono restituiti al driver. Se viene passato uno stream dedicato le copie
+    non bloccano il calcolo: l'evento registrato va atteso prima del ripristino.
     """
     
     original_device = next(module.parameters()).device
+    event = None
+    
+    if original_device.type == "cuda":
+        pinned = pin_cache.get(name) if pin_cache is not None else None
+        if pinned is None:
+            pinned = {
+                pname: torch.empty_like(p, device="cpu", pin_memory=True)
+                for pname, p in module.named_parameters()
+            }
+            if pin_cache is not None:
+                pin_cache[name] = pinned
+        
+        if stream is not None:
+            # Le copie partono solo dopo il lavoro già accodato sullo stream corrente
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                for pname, param in module.named_parameters():
+                    buffer = pinned[pname]
+                    buffer.copy_(param.data, non_blocking=True)
+                    # Impedisce all'allocator di riusare la memoria prima della copia
+                    param.data.record_stream(stream)
+                    param.data = buffer
+            event = torch.cuda.Event()
+            event.record(stream)
+        else:
+            for pname, param in module.named_parameters():
+                buffer = pinned[pname]
+                buffer.copy_(param.data, non_blocking=True)
+                param.data = buffer
+            
+            torch.cuda.synchronize()
+            torch.cuda.empty_cache()
     
-    # Sposta su CPU
+    # Sposta su CPU (i parametri già copiati restano sui buffer pinned)
     module.cpu()
     
     logger.debug(f"Modulo {name} spostato da {original_device} a CPU")
     
-    return {
-        "original_device": str(original_device),
+    info = {
+        "original_device": original_device,
         "current_device": "cpu",
         "method": "cpu"
     }
+    if event is not None:
+        info["event"] = event
+    
+    return info
 
 
-def _offload_to_disk(module: torch.nn.Module, name: str, temp_dir: Optional[str] = None) -> Dict[str, Any]:
+def _offload_to_disk(
+    module: torch.nn.Module,
+    name: str,
+    temp_dir: Optional[str] = None
+) -> Dict[str, Any]:
     """
     Offload modulo su disco.
     """
@@ -86,27 +148,126 @@ def _offload_to_disk(module: torch.nn.Module, name: str, temp_dir: Optional[str]
     if temp_dir is None:
         temp_dir = tempfile.gettempdir()
     
-    temp_path = Path(temp_dir) / f"offload_{name}.pt"
-    temp_path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = ".safetensors" if save_file is not None else ".pt"
+    temp_path = Path(temp_dir) / f"offload_{name}{suffix}"
     
     original_device = next(module.parameters()).device
     
-    # Salva stato su disco
-    torch.save(module.state_dict(), temp_path)
-    
-    # Rimuovi parametri dalla memoria
+    # Salva stato su disco in un unico file contiguo (safetensors); keep_vars +
+    # detach passano viste sui tensori esistenti, senza copie intermedie
+    # Scrive su un file temporaneo e lo rinomina atomicamente: un offload
+    # interrotto non lascia mai un file parziale al percorso finale
+    state_dict, aliases = _unique_state_dict(module)
+    partial_path = temp_path.with_suffix(temp_path.suffix + ".tmp")
+    try:
+        _write_state_dict(state_dict, partial_path)
+    except Exception:
+        # Directory mai creata o rimossa dopo un offload precedente; safetensors
+        # segnala l'errore di I/O come SafetensorError, non FileNotFoundError
+        if partial_path.parent.is_dir():
+            raise
+        _offload_dir(temp_dir)
+        _write_state_dict(state_dict, partial_path)
+    os.replace(partial_path, temp_path)
+    del state_dict
+    
+    _drop_page_cache(temp_path)
+    
+    # Rimuovi parametri dalla memoria liberando lo storage in place: nessun
+    # nuovo tensore per parametro. Gli storage non ridimensionabili (file
+    # mappati con mmap, array NumPy, storage condivisi) vengono sostituiti
     for param in module.parameters():
-        param.data = torch.empty(0)
+        try:
+            param.data.untyped_storage().resize_(0)
+        except RuntimeError:
+            param.data = torch.empty(0, dtype=param.dtype, device=param.device)
+    
+    if original_device.type == "cuda":
+        torch.cuda.empty_cache()
     
     logger.debug(f"Modulo {name} salvato su disco: {temp_path}")
     
     return {
-        "original_device": str(original_device),
+        "original_device": original_device,
         "temp_path": str(temp_path),
+        "aliases": aliases,
         "method": "disk"
     }
 
 
+def _unique_state_dict(module: torch.nn.Module) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Restituisce lo state_dict senza duplicati e la mappa alias -> chiave salvata.
+    
+    save_file rifiuta i tensori condivisi (es. embedding e lm_head legati):
+    ogni parametro viene salvato una volta sola e gli alias vengono
+    ricollegati allo stesso tensore al ripristino.
+    """
+    
+    state_dict = {}
+    aliases = {}
+    seen = {}
+    for key, value in module.state_dict(keep_vars=True).items():
+        canonical = seen.setdefault(id(value), key)
+        if canonical == key:
+            state_dict[key] = value.detach()
+        else:
+            aliases[key] = canonical
+    
+    return state_dict, aliases
+
+
+def _write_state_dict(state_dict: Dict[str, torch.Tensor], path: Path) -> None:
+    """
+    Scrive lo state_dict in path (safetensors, o torch.save senza safetensors).
+    """
+    
+    if save_file is not None:
+        save_file(state_dict, str(path))
+    else:
+        torch.save(state_dict, path)
+
+
+def _offload_dir(temp_dir: str) -> Path:
+    """
+    Crea la directory di offload e la restituisce.
+    
+    Chiamata una volta da OffloadManager e poi solo se una scrittura fallisce
+    perché la directory non esiste (es. rimossa dalla pulizia di /tmp).
+    """
+    
+    path = Path(temp_dir)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _drop_page_cache(path: Path) -> None:
+    """
+    Chiede al kernel di non trattenere in page cache il file appena scritto.
+    
+    Senza questo i pesi offloaded resterebbero anche in RAM, vanificando
+    l'offload proprio sui nodi sotto pressione di memoria. Il kernel scarta
+    solo pagine già scritte su disco, quindi il file viene prima sincronizzato.
+    No-op dove posix_fadvise non è disponibile (es. Windows, macOS).
+    """
+    
+    if not hasattr(os, "posix_fadvise"):
+        return
+    
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    
+    try:
+        os.fdatasync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
 def restore_modules(
     modules: Dict[str, torch.nn.Module],
     offload_info: Dict[str, Any]
@@ -124,18 +285,60 @@ def restore_modules(
     
     logger.info(f"Ripristino {len(modules)} moduli da {offload_type}")
     
+    cpu_entries = []
     for name, module in modules.items():
         if name in module_info:
             info = module_info[name]
             
             if info["method"] == "cpu":
-                _restore_from_cpu(module, info)
+                cpu_entries.append((module, info))
             elif info["method"] == "disk":
                 _restore_from_disk(module, info)
     
+    if cpu_entries:
+        _restore_many_from_cpu(cpu_entries)
+    
     logger.info("Ripristino moduli completato")
 
 
+def _restore_many_from_cpu(entries: List[Tuple[torch.nn.Module, Dict[str, Any]]]) -> None:
+    """
+    Ripristina più moduli da CPU con un'unica copia multi-tensore.
+    
+    I parametri di tutti i moduli diretti allo stesso device vengono copiati con
+    torch._foreach_copy_, che raggruppa le N*M piccole copie H2D in pochi kernel.
+    """
+    
+    if not hasattr(torch, "_foreach_copy_"):
+        for module, info in entries:
+            _restore_from_cpu(module, info)
+        return
+    
+    by_device: Dict[str, List[Tuple[torch.nn.Module, Dict[str, Any]]]] = {}
+    for module, info in entries:
+        by_device.setdefault(info["original_device"], []).append((module, info))
+    
+    for original_device, group in by_device.items():
+        for _, info in group:
+            event = info.get("event")
+            if event is not None:
+                event.wait()
+        
+        params = [p for module, _ in group for p in module.parameters()]
+        srcs = [p.data for p in params]
+        dsts = [torch.empty_like(src, device=original_device) for src in srcs]
+        torch._foreach_copy_(dsts, srcs, non_blocking=True)
+        
+        for param, dst in zip(params, dsts):
+            param.data = dst
+        
+        # Buffer non parametrici (i parametri sono già sul device)
+        for module, _ in group:
+            module.to(original_device, non_blocking=True)
+        
+        logger.debug(f"{len(group)} moduli ripristinati da CPU a {original_device}")
+
+
 def _restore_from_cpu(module: torch.nn.Module, info: Dict[str, Any]) -> None:
     """
     Ripristina modulo da CPU.
@@ -143,8 +346,13 @@ def _restore_from_cpu(module: torch.nn.Module, info: Dict[str, Any]) -> None:
     
     original_device = info["original_device"]
     
-    # Sposta al device originale
-    module.to(original_device)
+    # Attende (lato GPU) il completamento della copia di offload asincrona
+    event = info.get("event")
+    if event is not None:
+        event.wait()
+    
+    # Sposta al device originale (copia asincrona dai buffer pinned)
+    module.to(original_device, non_blocking=True)
     
     logger.debug(f"Modulo ripristinato da CPU a {original_device}")
 
@@ -157,9 +365,17 @@ def _restore_from_disk(module: torch.nn.Module, info: Dict[str, Any]) -> None:
     temp_path = info["temp_path"]
     original_device = info["original_device"]
     
-    # Carica stato da disco
-    state_dict = torch.load(temp_path, map_location=original_device)
-    module.load_state_dict(state_dict)
+    # Carica stato da disco: safe_open mappa il file in memoria e materializza
+    # i tensori direttamente sul device originale; assign=True evita la copia
+    # nei parametri svuotati durante l'offload
+    if temp_path.endswith(".safetensors"):
+        with safe_open(temp_path, framework="pt", device=str(original_device)) as f:
+            state_dict = {k: f.get_tensor(k) for k in f.keys()}
+    else:
+        state_dict = torch.load(temp_path, map_location=original_device, weights_only=True)
+    for alias, canonical in info.get("aliases", {}).items():
+        state_dict[alias] = state_dict[canonical]
+    module.load_state_dict(state_dict, assign=True)
     
     # Pulisci file temporaneo
     Path(temp_path).unlink(missing_ok=True)
@@ -200,8 +416,17 @@ class OffloadManager:
     
     def __init__(self, temp_dir: Optional[str] = None):
         self.temp_dir = temp_dir or tempfile.gettempdir()
+        self._dir = _offload_dir(self.temp_dir)
         self.offloaded_modules = {}
         self.offload_info = {}
+        self._pin_cache = {}
+        self._offload_stream = None
+    
+    def _get_offload_stream(self) -> Optional["torch.cuda.Stream"]:
+        """Restituisce (creandolo al primo uso) lo stream CUDA dedicato all'offload."""
+        if self._offload_stream is None and torch.cuda.is_available():
+            self._offload_stream = torch.cuda.Stream(priority=-1)
+        return self._offload_stream
     
     def offload(self, name: str, module: torch.nn.Module, offload_type: str = "cpu"):
         """
@@ -214,7 +439,13 @@ class OffloadManager:
         
         self.offloaded_modules[name] = module
         
-        info = offload_modules({name: module}, offload_type, self.temp_dir)
+        info = offload_modules(
+            {name: module},
+            offload_type,
+            self.temp_dir,
+            self._pin_cache,
+            self._get_offload_stream() if offload_type == "cpu" else None
+        )
         self.offload_info[name] = info["modules"][name]
         
         logger.info(f"Modulo {name} offloaded su {offload_type}")
@@ -249,17 +480,30 @@ class OffloadManager:
         for name in list(self.offloaded_modules.keys()):
             self.restore(name)
     
+    def flush(self):
+        """
+        Attende il completamento delle copie di offload in corso e restituisce
+        al driver la memoria GPU liberata.
+        """
+        
+        if self._offload_stream is not None:
+            self._offload_stream.synchronize()
+            torch.cuda.empty_cache()
+    
     def cleanup(self):
         """
         Pulisce tutti i file temporanei.
         """
         
+        self.flush()
+        
         for info in self.offload_info.values():
             if info["method"] == "disk" and "temp_path" in info:
                 Path(info["temp_path"]).unlink(missing_ok=True)
         
         self.offloaded_modules.clear()
         self.offload_info.clear()
+        self._pin_cache.clear()
         
         logger.info("Cleanup offload completato")
     
@@ -12,13 +12,19 @@ Questo package fornisce:
 - Offloading su disco
 """
 
+import functools
+
 import torch
 
 
+@functools.lru_cache(maxsize=1)
 def get_default_device() -> str:
     """
     Determina il miglior device disponibile.
     
+    Il risultato viene calcolato una sola volta: i device disponibili non
+    cambiano durante l'esecuzione.
+    
     Returns:
         str: Nome del device ('cuda', 'mps', o 'cpu')
     """
@@ -8,6 +8,8 @@ Gestisce settings, logging e configurazioni globali per mappare l'invisibile.
 Author: Francesco Bulla (Brainverse)
 """
 
+import logging
+
 from .settings import OnepaiSettings, get_settings
 from .logging_config import setup_logging, get_logger
 
@@ -32,11 +34,13 @@ def initialize_onepai():
     settings = get_settings()
     logger = setup_logging()
     
-    logger.info("🔥 ONEPAI Sistema Inizializzato")
-    logger.info(f"📊 Shadow Sensitivity: {settings.shadow_sensitivity}")
-    logger.info(f"🔇 Silence Threshold: {settings.silence_threshold}")
-    logger.info(f"🕳️ Void Detection Depth: {settings.void_detection_depth}")
-    logger.info(f"🔐 Treasure Encryption: {'ENABLED' if settings.treasure_encryption else 'DISABLED'}")
+    # Formattazione %-style differita: nessun costo se INFO è disabilitato
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("🔥 ONEPAI Sistema Inizializzato")
+        logger.info("📊 Shadow Sensitivity: %s", settings.shadow_sensitivity)
+        logger.info("🔇 Silence Threshold: %s", settings.silence_threshold)
+        logger.info("🕳️ Void Detection Depth: %s", settings.void_detection_depth)
+        logger.info("🔐 Treasure Encryption: %s", 'ENABLED' if settings.treasure_encryption else 'DISABLED')
     
     return settings, logger
 
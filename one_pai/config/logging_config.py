@@ -10,14 +10,42 @@ Author: Francesco Bulla (Brainverse)
 
 import logging
 import logging.handlers
+import atexit
+import functools
+import queue
 import sys
 import json
-from datetime import datetime
+import time
 from pathlib import Path
 from typing import Dict, Any, Optional
 from dataclasses import dataclass
 
-@dataclass
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Parole chiave nel nome del logger -> tipo di log, in ordine di priorità
+_LOG_TYPE_KEYWORDS = (
+    ('shadow', 'shadow'),
+    ('silence', 'silence'),
+    ('void', 'void'),
+    ('treasure', 'treasure'),
+    ('observer', 'observer'),
+    ('neural', 'neural'),
+    ('memory', 'memory'),
+    ('analysis', 'analysis'),
+    ('crypto', 'crypto'),
+    ('api', 'api'),
+)
+
+# Cache nome logger -> tipo di log ('' se nessuna parola chiave corrisponde)
+_LOG_TYPE_CACHE: Dict[str, str] = {}
+
+# Listener attivo che scrive i log in background
+_queue_listener: Optional[logging.handlers.QueueListener] = None
+
+@dataclass(slots=True)
 class LogConfig:
     """Configurazione logging ONEPAI"""
     level: str = "INFO"
@@ -70,73 +98,136 @@ class OnepaiFormatter(logging.Formatter):
         'RESET': '\033[0m'        # Reset
     }
     
+    # Template unico per il record (symbol, timestamp, level, name, extra, msg)
+    TEMPLATE = "%s %s [%-8s] %-20s %s | %s"
+    
     def __init__(self, format_type: str = "shadow", use_colors: bool = True):
         self.format_type = format_type
         self.use_colors = use_colors
         super().__init__()
+        
+        # Conversione come Formatter.formatTime; (secondo, testo) dell'ultimo timestamp
+        self.converter = time.localtime
+        self._ts_cache = (None, '')
+        
+        # Valori costanti per tutta la vita del formatter, calcolati una volta
+        self._color_reset = self.COLORS['RESET']
+        self._extra_attrs = (
+            ('shadow_id', 'Shadow'),
+            ('treasure_id', 'Treasure'),
+            ('void_depth', 'Void'),
+            ('silence_type', 'Silence'),
+        )
     
     def format(self, record: logging.LogRecord) -> str:
         """
         Formatta il record di log con simboli e colori ONEPAI
         """
-        # Determina il tipo di log dal nome del modulo
-        log_type = self._get_log_type(record)
-        symbol = self.SYMBOLS.get(log_type, self.SYMBOLS.get(record.levelname.lower(), '📝'))
+        # Colore e simbolo del livello in un solo lookup; il tipo dal nome
+        # del modulo ha la precedenza sul simbolo del livello
+        color, level_symbol = _LEVEL_STYLE.get(record.levelname, _DEFAULT_LEVEL_STYLE)
+        symbol = _TYPE_SYMBOL.get(self._get_log_type(record)) or level_symbol
         
-        # Timestamp formattato
-        timestamp = datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        # Timestamp formattato (millisecondi da record.msecs); la parte fino
+        # ai secondi si ricalcola solo quando cambia il secondo
+        second = int(record.created)
+        cached_second, head = self._ts_cache
+        if second != cached_second:
+            head = time.strftime('%Y-%m-%d %H:%M:%S', self.converter(record.created))
+            self._ts_cache = (second, head)
+        timestamp = f"{head}.{int(record.msecs):03d}"
         
         # Informazioni extra se presenti
-        extra_info = ""
-        if hasattr(record, 'shadow_id'):
-            extra_info += f" [Shadow:{record.shadow_id}]"
-        if hasattr(record, 'treasure_id'):
-            extra_info += f" [Treasure:{record.treasure_id}]"
-        if hasattr(record, 'void_depth'):
-            extra_info += f" [Void:{record.void_depth}]"
-        if hasattr(record, 'silence_type'):
-            extra_info += f" [Silence:{record.silence_type}]"
+        parts = []
+        record_dict = record.__dict__
+        for attr, label in self._extra_attrs:
+            value = record_dict.get(attr)
+            if value is not None:
+                parts.append(f" [{label}:{value}]")
+        extra_info = "".join(parts)
         
         # Formato base
-        base_format = f"{symbol} {timestamp} [{record.levelname:8}] {record.name:20} {extra_info} | {record.getMessage()}"
+        base_format = self.TEMPLATE % (
+            symbol, timestamp, record.levelname, record.name, extra_info, record.getMessage()
+        )
         
-        # Aggiunge colori se abilitati e se siamo in un terminal
-        if self.use_colors and hasattr(sys.stderr, 'isatty') and sys.stderr.isatty():
-            color = self.COLORS.get(record.levelname, self.COLORS['INFO'])
-            base_format = f"{color}{base_format}{self.COLORS['RESET']}"
+        # Aggiunge colori se abilitati (il controllo del terminale è in setup_logging)
+        if self.use_colors:
+            base_format = f"{color}{base_format}{self._color_reset}"
         
-        # Aggiunge stack trace per errori
+        # Aggiunge stack trace per errori, reso una sola volta per record
         if record.exc_info:
-            base_format += "\n" + self.formatException(record.exc_info)
+            if not record.exc_text:
+                record.exc_text = self.formatException(record.exc_info)
+            base_format += "\n" + record.exc_text
         
         return base_format
     
     def _get_log_type(self, record: logging.LogRecord) -> str:
         """Determina il tipo di log dal nome del modulo"""
-        module_name = record.name.lower()
+        log_type = _LOG_TYPE_CACHE.get(record.name)
+        
+        if log_type is None:
+            module_name = record.name.lower()
+            log_type = ''
+            for keyword, keyword_type in _LOG_TYPE_KEYWORDS:
+                if keyword in module_name:
+                    log_type = keyword_type
+                    break
+            _LOG_TYPE_CACHE[record.name] = log_type
+        
+        # Senza parola chiave il tipo dipende dal livello del singolo record
+        return log_type or record.levelname.lower()
+
+# Tabelle precalcolate per OnepaiFormatter.format
+_TYPE_SYMBOL = {
+    log_type: OnepaiFormatter.SYMBOLS[log_type] for _, log_type in _LOG_TYPE_KEYWORDS
+}
+_LEVEL_STYLE = {
+    level: (OnepaiFormatter.COLORS[level], OnepaiFormatter.SYMBOLS.get(level.lower(), '📝'))
+    for level in ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+}
+_DEFAULT_LEVEL_STYLE = (OnepaiFormatter.COLORS['INFO'], '📝')
+
+class OnepaiJSONFormatter(logging.Formatter):
+    """
+    Formatter JSON compatto per i file di log
+    Una riga per record, senza simboli, colori né strftime
+    """
+    
+    EXTRA_ATTRS = ('shadow_id', 'treasure_id', 'void_depth', 'silence_type')
+    
+    def format(self, record: logging.LogRecord) -> str:
+        """Serializza il record come oggetto JSON su una riga"""
+        data = {
+            'ts': record.created,
+            'lvl': record.levelname,
+            'name': record.name,
+            'msg': record.getMessage(),
+        }
+        
+        record_dict = record.__dict__
+        for attr in self.EXTRA_ATTRS:
+            value = record_dict.get(attr)
+            if value is not None:
+                data[attr] = value
         
-        if 'shadow' in module_name:
-            return 'shadow'
-        elif 'silence' in module_name:
-            return 'silence'
-        elif 'void' in module_name:
-            return 'void'
-        elif 'treasure' in module_name:
-            return 'treasure'
-        elif 'observer' in module_name:
-            return 'observer'
-        elif 'neural' in module_name:
-            return 'neural'
-        elif 'memory' in module_name:
-            return 'memory'
-        elif 'analysis' in module_name:
-            return 'analysis'
-        elif 'crypto' in module_name:
-            return 'crypto'
-        elif 'api' in module_name:
-            return 'api'
-        else:
-            return record.levelname.lower()
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        
+        if orjson is not None:
+            return orjson.dumps(data, default=str).decode()
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler che accoda il record così com'è
+    La coda resta nel processo: messaggio e traceback vengono resi dai
+    formatter nel thread del listener, non da prepare() nel produttore
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
 
 class OnepaiLoggerAdapter(logging.LoggerAdapter):
     """
@@ -147,37 +238,34 @@ class OnepaiLoggerAdapter(logging.LoggerAdapter):
         """Aggiunge informazioni di contesto al messaggio"""
         return msg, kwargs
     
+    def _kv(self, level: int, msg: str, key: str, val: Any, kwargs: Dict[str, Any]):
+        """Log con un singolo campo extra, senza lavoro se il livello è filtrato"""
+        logger = self.logger
+        if not logger.isEnabledFor(level):
+            return
+        if val is not None:
+            extra = kwargs.get('extra')
+            if extra is None:
+                kwargs['extra'] = {key: val}
+            else:
+                extra[key] = val
+        logger.log(level, msg, **kwargs)
+    
     def shadow(self, msg: str, shadow_id: Optional[str] = None, **kwargs):
         """Log specifico per operazioni shadow"""
-        extra = kwargs.get('extra', {})
-        if shadow_id:
-            extra['shadow_id'] = shadow_id
-        kwargs['extra'] = extra
-        self.info(msg, **kwargs)
+        self._kv(logging.INFO, msg, 'shadow_id', shadow_id, kwargs)
     
     def silence(self, msg: str, silence_type: Optional[str] = None, **kwargs):
         """Log specifico per operazioni silence"""
-        extra = kwargs.get('extra', {})
-        if silence_type:
-            extra['silence_type'] = silence_type
-        kwargs['extra'] = extra
-        self.info(msg, **kwargs)
+        self._kv(logging.INFO, msg, 'silence_type', silence_type, kwargs)
     
     def void(self, msg: str, void_depth: Optional[int] = None, **kwargs):
         """Log specifico per operazioni void"""
-        extra = kwargs.get('extra', {})
-        if void_depth:
-            extra['void_depth'] = void_depth
-        kwargs['extra'] = extra
-        self.info(msg, **kwargs)
+        self._kv(logging.INFO, msg, 'void_depth', void_depth, kwargs)
     
     def treasure(self, msg: str, treasure_id: Optional[str] = None, **kwargs):
         """Log specifico per operazioni treasure"""
-        extra = kwargs.get('extra', {})
-        if treasure_id:
-            extra['treasure_id'] = treasure_id
-        kwargs['extra'] = extra
-        self.info(msg, **kwargs)
+        self._kv(logging.INFO, msg, 'treasure_id', treasure_id, kwargs)
 
 def setup_logging(config: Optional[LogConfig] = None) -> OnepaiLoggerAdapter:
     """
@@ -189,9 +277,16 @@ def setup_logging(config: Optional[LogConfig] = None) -> OnepaiLoggerAdapter:
     Returns:
         OnepaiLoggerAdapter: Logger principale configurato
     """
+    global _queue_listener
+    
     if config is None:
         config = LogConfig()
     
+    # Ferma il listener di una configurazione precedente
+    if _queue_listener is not None:
+        _stop_listener(_queue_listener)
+        _queue_listener = None
+    
     # Logger principale
     logger = logging.getLogger("onepai")
     logger.setLevel(getattr(logging, config.level.upper()))
@@ -200,17 +295,31 @@ def setup_logging(config: Optional[LogConfig] = None) -> OnepaiLoggerAdapter:
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
     
+    # Logging disattivato: ogni chiamata si ferma al controllo del livello
+    if not (config.log_to_file or config.log_to_console):
+        logger.addHandler(logging.NullHandler())
+        logger.setLevel(logging.CRITICAL + 1)
+        adapter = OnepaiLoggerAdapter(logger, {})
+        adapter.listener = None
+        return adapter
+    
+    handlers = []
+    
+    # Colori solo se la console è un terminale, verificato una volta qui;
+    # stdout può essere None (pythonw, demoni) o uno stream senza isatty
+    use_colors = config.log_to_console and getattr(sys.stdout, "isatty", lambda: False)()
+    
     # Formatter personalizzato
     formatter = OnepaiFormatter(
         format_type=config.format_type,
-        use_colors=config.log_to_console
+        use_colors=use_colors
     )
     
     # Handler per console
     if config.log_to_console:
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
     
     # Handler per file
     if config.log_to_file:
@@ -224,23 +333,40 @@ def setup_logging(config: Optional[LogConfig] = None) -> OnepaiLoggerAdapter:
             encoding='utf-8'
         )
         
-        # Formatter senza colori per file
-        file_formatter = OnepaiFormatter(
-            format_type=config.format_type,
-            use_colors=False
+        # Formatter JSON per file: nessun simbolo o colore da rendere
+        file_handler.setFormatter(OnepaiJSONFormatter())
+        
+        # Buffer in memoria: una scrittura ogni 64 record, subito su ERROR
+        buffered_handler = logging.handlers.MemoryHandler(
+            capacity=64,
+            flushLevel=logging.ERROR,
+            target=file_handler,
+            flushOnClose=True
+        )
+        handlers.append(buffered_handler)
+    
+    # I produttori accodano soltanto: formattazione, rotazione e I/O
+    # avvengono nel thread del listener
+    listener = None
+    if handlers:
+        log_queue = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(
+            log_queue, *handlers, respect_handler_level=True
         )
-        file_handler.setFormatter(file_formatter)
-        logger.addHandler(file_handler)
+        listener.start()
+        logger.addHandler(_DeferredQueueHandler(log_queue))
+        _queue_listener = listener
     
     # Adapter personalizzato
     adapter = OnepaiLoggerAdapter(logger, {})
+    adapter.listener = listener
     
     # Log di inizializzazione
     adapter.info("🔥 ONEPAI Logging System Initialized")
-    adapter.info(f"📊 Log Level: {config.level}")
-    adapter.info(f"📝 Format Type: {config.format_type}")
-    adapter.info(f"💾 Log to File: {config.log_to_file}")
-    adapter.info(f"🖥️ Log to Console: {config.log_to_console}")
+    adapter.info("📊 Log Level: %s", config.level)
+    adapter.info("📝 Format Type: %s", config.format_type)
+    adapter.info("💾 Log to File: %s", config.log_to_file)
+    adapter.info("🖥️ Log to Console: %s", config.log_to_console)
     
     return adapter
 
@@ -252,8 +378,32 @@ def get_logger(name: str = "onepai") -> OnepaiLoggerAdapter:
     Returns:
         OnepaiLoggerAdapter: Logger configurato
     """
-    logger = logging.getLogger(name)
-    return OnepaiLoggerAdapter(logger, {})
+    return _cached_adapter(name)
+
+@functools.lru_cache(maxsize=None)
+def _cached_adapter(name: str) -> OnepaiLoggerAdapter:
+    """Un solo adapter per nome di logger, creato alla prima richiesta"""
+    return OnepaiLoggerAdapter(logging.getLogger(name), {})
+
+def _stop_listener(listener: logging.handlers.QueueListener) -> None:
+    """Ferma il listener se è ancora attivo e svuota i suoi handler"""
+    if getattr(listener, '_thread', None) is not None:
+        listener.stop()
+    for handler in listener.handlers:
+        # MemoryHandler.close() svuota il buffer ma non chiude il suo target
+        target = getattr(handler, 'target', None)
+        handler.close()
+        if target is not None:
+            target.close()
+
+def _stop_queue_listener() -> None:
+    """Svuota la coda e ferma il listener all'uscita"""
+    global _queue_listener
+    if _queue_listener is not None:
+        _stop_listener(_queue_listener)
+        _queue_listener = None
+
+atexit.register(_stop_queue_listener)
 
 # Logger globale predefinito
 _default_logger: Optional[OnepaiLoggerAdapter] = None
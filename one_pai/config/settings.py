@@ -9,11 +9,15 @@ Author: Francesco Bulla (Brainverse)
 """
 
 import os
-import yaml
-from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Union
+import copy
+from dataclasses import asdict, dataclass, field
+from typing import ClassVar, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
+# File YAML già interpretati in questo processo:
+# percorso risolto -> ((mtime_ns, dimensione), dati)
+_PARSED_CONFIGS: Dict[str, Tuple[Tuple[int, int], dict]] = {}
+
 @dataclass
 class OnepaiSettings:
     """
@@ -70,6 +74,14 @@ class OnepaiSettings:
     real_time_updates: bool = True          # Aggiornamenti real-time
     max_visualization_points: int = 5000    # Max punti visualizzazione
     
+    # Campi che contengono directory da creare
+    _DIR_FIELDS: ClassVar[Tuple[str, ...]] = (
+        'treasures_dir',
+        'shadows_dir',
+        'voids_dir',
+        'silences_dir',
+    )
+    
     def __post_init__(self):
         """Validazione e creazione directory dopo inizializzazione"""
         self._validate_parameters()
@@ -91,15 +103,8 @@ class OnepaiSettings:
     
     def _create_directories(self):
         """Crea le directory necessarie se non esistono"""
-        dirs = [
-            self.treasures_dir,
-            self.shadows_dir, 
-            self.voids_dir,
-            self.silences_dir
-        ]
-        
-        for dir_path in dirs:
-            Path(dir_path).mkdir(parents=True, exist_ok=True)
+        for field_name in self._DIR_FIELDS:
+            Path(getattr(self, field_name)).mkdir(parents=True, exist_ok=True)
     
     @classmethod
     def from_file(cls, config_path: Union[str, Path]) -> 'OnepaiSettings':
@@ -114,13 +119,29 @@ class OnepaiSettings:
         """
         config_path = Path(config_path)
         
-        if not config_path.exists():
-            raise FileNotFoundError(f"File configurazione non trovato: {config_path}")
+        try:
+            stat = config_path.stat()
+        except FileNotFoundError:
+            raise FileNotFoundError(f"File configurazione non trovato: {config_path}") from None
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = yaml.safe_load(f)
+        # Lo YAML già interpretato si riusa finché mtime e dimensione non cambiano;
+        # la cache resta in memoria, con gli stessi tipi prodotti dal parser
+        key = str(config_path.resolve())
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = _PARSED_CONFIGS.get(key)
+        if cached is not None and cached[0] == version:
+            config_data = cached[1]
+        else:
+            import yaml
+            
+            # Parser libyaml in C quando disponibile
+            loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+            with open(config_path, 'r', encoding='utf-8') as f:
+                config_data = yaml.load(f, Loader=loader)
+            _PARSED_CONFIGS[key] = (version, config_data)
         
-        return cls(**config_data)
+        # Copia profonda: le liste delle istanze non devono condividere la cache
+        return cls(**copy.deepcopy(config_data))
     
     def save_to_file(self, config_path: Union[str, Path]):
         """
@@ -132,14 +153,24 @@ class OnepaiSettings:
         config_path = Path(config_path)
         config_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # Converte dataclass in dizionario
-        config_dict = {
-            field.name: getattr(self, field.name) 
-            for field in self.__dataclass_fields__.values()
-        }
+        # Converte dataclass in dizionario (copia profonda delle liste)
+        config_dict = asdict(self)
+        
+        import yaml
         
-        with open(config_path, 'w', encoding='utf-8') as f:
-            yaml.dump(config_dict, f, default_flow_style=False, allow_unicode=True)
+        # Emitter libyaml in C quando disponibile
+        dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+        
+        # Scrive su file temporaneo e lo sostituisce atomicamente:
+        # i lettori non vedono mai un file scritto a metà
+        tmp_path = config_path.with_suffix(config_path.suffix + '.tmp')
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                yaml.dump(config_dict, f, Dumper=dumper, default_flow_style=False, allow_unicode=True)
+            os.replace(tmp_path, config_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
     
     def get_treasure_path(self, treasure_name: str) -> Path:
         """Ottiene percorso completo per un file tesoro"""
@@ -161,6 +192,22 @@ class OnepaiSettings:
 # Istanza globale settings
 _settings_instance: Optional[OnepaiSettings] = None
 
+def _resolve_config_path() -> str:
+    """
+    Cerca il primo file configurazione esistente, "" se nessuno
+    
+    Chiamata solo finché non c'è un'istanza globale: ONEPAI_CONFIG e i file
+    vengono letti al primo get_settings(), non all'import, e un file creato
+    dopo un tentativo a vuoto viene trovato al successivo
+    """
+    # Cerca file configurazione in ordine di priorità
+    config_paths = (
+        "onepai.yaml",
+        "config/onepai.yaml",
+        os.getenv("ONEPAI_CONFIG", ""),
+    )
+    return next((p for p in config_paths if p and Path(p).exists()), "")
+
 def get_settings() -> OnepaiSettings:
     """
     Ottiene istanza globale delle impostazioni ONEPAI
@@ -168,23 +215,22 @@ def get_settings() -> OnepaiSettings:
     Returns:
         OnepaiSettings: Configurazione globale
     """
+    s = _settings_instance
+    if s is not None:
+        return s
+    
+    return _load_settings()
+
+def _load_settings() -> OnepaiSettings:
+    """Percorso lento: carica la configurazione dal file trovato o i default"""
     global _settings_instance
     
-    if _settings_instance is None:
-        # Cerca file configurazione in ordine di priorità
-        config_paths = [
-            "onepai.yaml",
-            "config/onepai.yaml", 
-            os.getenv("ONEPAI_CONFIG", ""),
-        ]
-        
-        for config_path in config_paths:
-            if config_path and Path(config_path).exists():
-                _settings_instance = OnepaiSettings.from_file(config_path)
-                break
-        else:
-            # Usa configurazione predefinita
-            _settings_instance = OnepaiSettings()
+    config_path = _resolve_config_path()
+    if config_path:
+        _settings_instance = OnepaiSettings.from_file(config_path)
+    else:
+        # Usa configurazione predefinita
+        _settings_instance = OnepaiSettings()
     
     return _settings_instance
 
@@ -5,14 +5,31 @@ Questo script analizza i pattern di silenzio nei modelli AI,
 identificando neuroni silenziosi, pensieri soppressi e decisioni non prese.
 """
 
+import os
+import re
 import sys
 import argparse
+import hashlib
 import json
+import zipfile
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba è opzionale: senza di esso si usano le operazioni NumPy
+    njit = None
+
 # Aggiungi il percorso src al PYTHONPATH
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root / "src"))
@@ -21,6 +38,18 @@ from onepai.core.silence_tracer import SilenceTracer
 from onepai.analysis.silence_metrics import SilenceMetrics
 from onepai.memory.unsaid_vault import UnsaidVault
 
+# Parser JSON in C quando disponibile (accetta bytes in entrambi i casi)
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Cache su disco delle tracce, solo con --trace-cache: le tracce contengono
+# i contenuti soppressi in chiaro. Oltre TRACE_CACHE_MAX_BYTES si eliminano
+# le voci usate meno di recente
+TRACE_CACHE_MAX_BYTES = 1 << 30
+
+# Le attivazioni si tengono in float32: in float16 i valori grandi vanno a inf e
+# quelli vicini alla soglia di silenzio possono cambiare lato nei confronti
+ACTIVATION_DTYPE = np.float32
+
 
 def create_parser() -> argparse.ArgumentParser:
     """Crea il parser per gli argomenti dello script."""
@@ -88,6 +117,26 @@ def create_parser() -> argparse.ArgumentParser:
         help='Salva i contenuti non espressi in un vault'
     )
     
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Processi paralleli per il tracciamento degli input (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help='Non riusare le tracce di input ripetuti né la cache su disco'
+    )
+    
+    parser.add_argument(
+        '--trace-cache',
+        metavar='DIR',
+        help='Directory in cui salvare e riusare le tracce tra esecuzioni '
+             '(disattivata di default: le tracce contengono i contenuti soppressi in chiaro)'
+    )
+    
     parser.add_argument(
         '--verbose', '-v',
         action='store_true',
@@ -106,25 +155,235 @@ def create_parser() -> argparse.ArgumentParser:
 def load_input_data(input_file: str) -> List[Dict[str, Any]]:
     """Carica i dati di input per l'analisi."""
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            if input_file.endswith('.json'):
-                return json.load(f)
-            elif input_file.endswith('.jsonl'):
-                return [json.loads(line) for line in f]
-            else:
-                # Assume text file with one input per line
+        if input_file.endswith('.json'):
+            with open(input_file, 'rb') as f:
+                return _json_loads(f.read())
+        elif input_file.endswith('.jsonl'):
+            with open(input_file, 'rb', buffering=1 << 20) as f:
+                return [_json_loads(line) for line in f if line.strip()]
+        else:
+            # Assume text file with one input per line
+            with open(input_file, 'r', encoding='utf-8', buffering=1 << 20) as f:
                 return [{'text': line.strip()} for line in f if line.strip()]
     except Exception as e:
         raise ValueError(f"Errore nel caricamento dei dati di input: {e}")
 
 
+@lru_cache(maxsize=4)
+def _get_tracer(model_path: str) -> SilenceTracer:
+    """Carica il tracer una sola volta per modello."""
+    return SilenceTracer(model_path)
+
+
+def _trace_sample(tracer: SilenceTracer, input_text: str, layers: Optional[List[int]],
+                  silence_threshold: float) -> Tuple[Dict, Dict, List, List]:
+    """Esegue il forward pass su un input e ne estrae silenzi e contenuti non espressi."""
+    silence_map = tracer.trace_silence(input_text, layers=layers)
+    activations = {
+        layer_name: np.asarray(layer_activations, dtype=ACTIVATION_DTYPE)
+        if isinstance(layer_activations, (list, np.ndarray)) else layer_activations
+        for layer_name, layer_activations in tracer.get_activations().items()
+    }
+    suppressed = tracer.identify_suppressed_thoughts(silence_threshold) or []
+    unexpressed = tracer.identify_unexpressed_decisions() or []
+    return silence_map, activations, suppressed, unexpressed
+
+
+@lru_cache(maxsize=4)
+def _model_fingerprint(model_path: str) -> Optional[List]:
+    """Dimensione e mtime_ns dei file del modello, None se non è un percorso locale.
+    
+    Entra nella chiave della cache: un modello riaddestrato o sostituito
+    nello stesso percorso non riusa le tracce del precedente.
+    """
+    path = Path(model_path)
+    try:
+        if path.is_file():
+            stat = path.stat()
+            return [stat.st_size, stat.st_mtime_ns]
+        if path.is_dir():
+            return sorted(
+                [str(file_path.relative_to(path)), stat.st_size, stat.st_mtime_ns]
+                for file_path in path.rglob('*') if file_path.is_file()
+                for stat in (file_path.stat(),)
+            )
+    except OSError:
+        pass
+    return None
+
+
+def _trace_cache_path(cache_dir: str, model_path: str, input_text: str,
+                      layers: Optional[Tuple[int, ...]], silence_threshold: float) -> Optional[Path]:
+    """Percorso del file di cache per una traccia, None se il modello non è un file locale."""
+    fingerprint = _model_fingerprint(model_path)
+    if fingerprint is None:
+        return None
+    key = json.dumps([model_path, fingerprint, input_text, layers, silence_threshold,
+                      np.dtype(ACTIVATION_DTYPE).name])
+    return Path(cache_dir) / f"{hashlib.sha1(key.encode('utf-8')).hexdigest()}.npz"
+
+
+def _to_jsonable(value: Any) -> Any:
+    """Converte scalari e array NumPy per json.dumps."""
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    raise TypeError(f"Tipo non serializzabile: {type(value).__name__}")
+
+
+def _pack_trace_value(value: Any, arrays: Dict[str, np.ndarray]) -> Any:
+    """Prepara un valore per il JSON della cache: gli array vanno in arrays, al loro
+    posto resta un riferimento, così al caricamento si ricostruiscono gli stessi tipi."""
+    if isinstance(value, np.ndarray):
+        key = f"array/{len(arrays)}"
+        arrays[key] = np.ascontiguousarray(value)
+        return {'__ndarray__': key}
+    if isinstance(value, np.generic):
+        return {'__npscalar__': value.dtype.str, 'value': value.item()}
+    if isinstance(value, dict):
+        return {key: _pack_trace_value(item, arrays) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_pack_trace_value(item, arrays) for item in value]
+    return value
+
+
+def _unpack_trace_value(value: Any, data) -> Any:
+    """Inverso di _pack_trace_value."""
+    if isinstance(value, dict):
+        if '__ndarray__' in value:
+            return data[value['__ndarray__']]
+        if '__npscalar__' in value:
+            return np.dtype(value['__npscalar__']).type(value['value'])
+        return {key: _unpack_trace_value(item, data) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_unpack_trace_value(item, data) for item in value]
+    return value
+
+
+def _store_trace(cache_path: Path, traced: Tuple[Dict, Dict, List, List]):
+    """Salva una traccia: gli array NumPy come voci contigue dell'npz, il resto come JSON."""
+    arrays = {}
+    try:
+        meta = _pack_trace_value(list(traced), arrays)
+        arrays['meta'] = np.array(json.dumps(meta, default=_to_jsonable))
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Scrittura atomica: più processi possono tracciare lo stesso input
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, cache_path)
+    except (OSError, TypeError, ValueError):
+        # La cache è un'ottimizzazione: se non si può salvare si prosegue
+        pass
+
+
+def _load_trace(cache_path: Path) -> Optional[Tuple[Dict, Dict, List, List]]:
+    """Carica una traccia dalla cache su disco, None se assente o illeggibile."""
+    try:
+        with np.load(cache_path, allow_pickle=False) as data:
+            silence_map, activations, suppressed, unexpressed = _unpack_trace_value(
+                json.loads(str(data['meta'])), data
+            )
+    except (OSError, KeyError, ValueError, TypeError, EOFError, zipfile.BadZipFile):
+        # Voce assente, troncata o di un formato precedente: si ritraccia
+        return None
+    
+    try:
+        # L'mtime segna l'ultimo uso, per eliminare prima le voci inutilizzate
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return silence_map, activations, suppressed, unexpressed
+
+
+def _prune_trace_cache(cache_dir: str, max_bytes: int = TRACE_CACHE_MAX_BYTES):
+    """Elimina le voci usate meno di recente finché la cache supera max_bytes."""
+    try:
+        entries = []
+        with os.scandir(cache_dir) as it:
+            for entry in it:
+                if entry.name.endswith('.npz') and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    except OSError:
+        return
+    
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+@lru_cache(maxsize=1024)
+def _traced(model_path: str, input_text: str, layers: Optional[Tuple[int, ...]],
+            silence_threshold: float, cache_dir: Optional[str] = None) -> Tuple[Dict, Dict, List, List]:
+    """Traccia un input riusando la cache in memoria e, con cache_dir, su disco.
+    
+    Il forward pass è deterministico per (modello, testo, layer, soglia):
+    i risultati in cache sono condivisi e non vanno modificati.
+    """
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = _trace_cache_path(cache_dir, model_path, input_text, layers, silence_threshold)
+    traced = _load_trace(cache_path) if cache_path is not None else None
+    if traced is None:
+        traced = _trace_sample(_get_tracer(model_path), input_text,
+                               list(layers) if layers else None, silence_threshold)
+        if cache_path is not None:
+            _store_trace(cache_path, traced)
+    return traced
+
+
+def _trace_one(model_path: str, text: str, layers: Optional[Tuple[int, ...]],
+               silence_threshold: float, use_cache: bool,
+               cache_dir: Optional[str] = None) -> Tuple[Dict, Dict, List, List]:
+    """Traccia un singolo input; usato sia in locale sia nei processi worker."""
+    if use_cache:
+        return _traced(model_path, text, layers, silence_threshold, cache_dir)
+    return _trace_sample(_get_tracer(model_path), text, list(layers) if layers else None,
+                         silence_threshold)
+
+
+def _trace_inputs(model_path: str, texts: List[str], layers: Optional[List[int]],
+                  silence_threshold: float, use_cache: bool = True,
+                  workers: int = 1, cache_dir: Optional[str] = None) -> Iterable[Tuple[Dict, Dict, List, List]]:
+    """Traccia gli input nell'ordine ricevuto, un risultato alla volta.
+    
+    Con la cache attiva i testi ripetuti passano una sola volta per il
+    modello; i risultati non vengono trattenuti oltre la cache stessa.
+    Con cache_dir le tracce vengono anche salvate e riusate su disco.
+    Con più worker ogni processo carica il proprio tracer una sola volta
+    (il tracer ha stato e non può essere condiviso tra thread).
+    """
+    layers_key = tuple(layers) if layers else None
+    
+    if workers <= 1 or len(texts) < 2:
+        for text in texts:
+            yield _trace_one(model_path, text, layers_key, silence_threshold, use_cache, cache_dir)
+    else:
+        n = len(texts)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_get_tracer,
+                                 initargs=(model_path,)) as pool:
+            yield from pool.map(
+                _trace_one,
+                [model_path] * n, texts, [layers_key] * n, [silence_threshold] * n, [use_cache] * n,
+                [cache_dir] * n, chunksize=4
+            )
+    
+    if use_cache and cache_dir is not None:
+        _prune_trace_cache(cache_dir)
+
+
 def analyze_silence_patterns(model_path: str, input_data: List[Dict[str, Any]], 
                            silence_threshold: float, layers: List[int] = None,
-                           analysis_depth: str = 'deep') -> Dict[str, Any]:
+                           analysis_depth: str = 'deep', use_cache: bool = True,
+                           workers: int = 1, trace_cache_dir: Optional[str] = None) -> Dict[str, Any]:
     """Analizza i pattern di silenzio nel modello."""
-    tracer = SilenceTracer(model_path)
-    metrics = SilenceMetrics()
-    
     results = {
         'analysis_metadata': {
             'model_path': model_path,
@@ -141,74 +400,117 @@ def analyze_silence_patterns(model_path: str, input_data: List[Dict[str, Any]],
         'silence_patterns': {}
     }
     
-    # Analizza ogni input
-    all_activations = []
+    # Raccoglie i testi; le tracce sono prodotte man mano durante l'aggregazione
+    texts = [
+        input_item['text'] if isinstance(input_item, dict) and 'text' in input_item else str(input_item)
+        for input_item in input_data
+    ]
+    traces = _trace_inputs(model_path, texts, layers, silence_threshold, use_cache, workers,
+                           trace_cache_dir)
+    
+    if analysis_depth == 'surface':
+        return _surface_analyze(results, texts, traces, silence_threshold, layers)
+    
+    # Analizza ogni input: le attivazioni confluiscono in statistiche per
+    # neurone e non vengono conservate campione per campione
+    layer_stats = {}
     all_silence_maps = []
     
-    for i, input_item in enumerate(input_data):
-        if isinstance(input_item, dict) and 'text' in input_item:
-            input_text = input_item['text']
-        else:
-            input_text = str(input_item)
-        
-        # Traccia il silenzio per questo input
-        silence_map = tracer.trace_silence(input_text, layers=layers)
-        activations = tracer.get_activations()
-        
-        all_activations.append(activations)
+    for i, (input_text, (silence_map, activations, suppressed, unexpressed)) in enumerate(zip(texts, traces)):
+        _update_layer_stats(layer_stats, activations, silence_threshold, layers)
         all_silence_maps.append(silence_map)
-        
-        # Identifica pensieri soppressi
-        suppressed = tracer.identify_suppressed_thoughts(silence_threshold)
-        if suppressed:
-            results['suppressed_thoughts'].extend([
-                {
-                    'input_index': i,
-                    'input_text': input_text[:100] + '...' if len(input_text) > 100 else input_text,
-                    'suppressed_content': thought,
-                    'layer': thought.get('layer'),
-                    'confidence': thought.get('confidence', 0.0)
-                }
-                for thought in suppressed
-            ])
-        
-        # Identifica decisioni non prese
-        unexpressed = tracer.identify_unexpressed_decisions()
-        if unexpressed:
-            results['unexpressed_decisions'].extend([
-                {
-                    'input_index': i,
-                    'input_text': input_text[:100] + '...' if len(input_text) > 100 else input_text,
-                    'decision_point': decision,
-                    'alternative_paths': decision.get('alternatives', []),
-                    'suppression_reason': decision.get('reason')
-                }
-                for decision in unexpressed
-            ])
+        _collect_sample_records(results, i, input_text, suppressed, unexpressed)
     
     # Calcola statistiche aggregate
     results['silence_statistics'] = calculate_silence_statistics(
-        all_silence_maps, all_activations, silence_threshold
+        all_silence_maps, silence_threshold
     )
     
     # Identifica neuroni costantemente silenziosi
-    results['silent_neurons'] = identify_silent_neurons(
-        all_activations, silence_threshold, layers
-    )
+    results['silent_neurons'] = _classify_silent_neurons(layer_stats)
     
     # Analizza pattern temporali se richiesto
     if analysis_depth in ['deep', 'comprehensive']:
         results['silence_patterns'] = analyze_temporal_patterns(
-            all_silence_maps, all_activations
+            all_silence_maps, layer_stats
         )
     
     return results
 
 
-def calculate_silence_statistics(silence_maps: List[Dict], activations: List[Dict], 
-                               threshold: float) -> Dict[str, Any]:
-    """Calcola statistiche sui pattern di silenzio."""
-    stats = {
+def _surface_analyze(results: Dict[str, Any], texts: List[str], traces: Iterable[Tuple],
+                     silence_threshold: float, layers: Optional[List[int]]) -> Dict[str, Any]:
+    """Analisi 'surface': nessun pattern temporale, quindi nessuna mappa conservata.
+    
+    Le statistiche di silenzio sono ridotte campione per campione e ogni
+    mappa viene scartata appena contata.
+    """
+    layer_stats = {}
+    silence_totals = {}
+    
+    for i, (input_text, (silence_map, activations, suppressed, unexpressed)) in enumerate(zip(texts, traces)):
+        _update_layer_stats(layer_stats, activations, silence_threshold, layers)
+        _accumulate_silence_totals(silence_totals, silence_map, silence_threshold)
+        _collect_sample_records(results, i, input_text, suppressed, unexpressed)
+    
+    results['silence_statistics'] = _finalize_silence_totals(silence_totals)
+    results['silent_neurons'] = _classify_silent_neurons(layer_stats)
+    
+    return results
+
+
+def _collect_sample_records(results: Dict[str, Any], index: int, input_text: str,
+                            suppressed: List[Dict], unexpressed: List[Dict]):
+    """Aggiunge ai risultati i pensieri soppressi e le decisioni non prese di un input."""
+    if not suppressed and not unexpressed:
+        return
+    
+    # Anteprima del testo calcolata una volta per input
+    input_text_preview = input_text[:100] + '...' if len(input_text) > 100 else input_text
+    
+    # Identifica pensieri soppressi
+    if suppressed:
+        results['suppressed_thoughts'].extend(
+            {
+                'input_index': index,
+                'input_text': input_text_preview,
+                'suppressed_content': thought,
+                'layer': thought.get('layer'),
+                'confidence': thought.get('confidence', 0.0)
+            }
+            for thought in suppressed
+        )
+    
+    # Identifica decisioni non prese
+    if unexpressed:
+        results['unexpressed_decisions'].extend(
+            {
+                'input_index': index,
+                'input_text': input_text_preview,
+                'decision_point': decision,
+                'alternative_paths': decision.get('alternatives', []),
+                'suppression_reason': decision.get('reason')
+            }
+            for decision in unexpressed
+        )
+
+
+def _as_float32_vector(values: Any) -> Optional[np.ndarray]:
+    """Vista piatta float32 dei valori di un layer, None se il tipo non è supportato.
+    
+    I buffer grezzi (bytes, memoryview) vengono letti senza copia, gli
+    ndarray float32 contigui passano così come sono.
+    """
+    if isinstance(values, (bytes, bytearray, memoryview)):
+        return np.frombuffer(values, dtype=np.float32)
+    if isinstance(values, (list, np.ndarray)):
+        return np.asarray(values, dtype=np.float32).ravel()
+    return None
+
+
+def _empty_silence_statistics() -> Dict[str, Any]:
+    """Struttura delle statistiche di silenzio senza campioni."""
+    return {
         'total_neurons_analyzed': 0,
         'silent_neuron_percentage': 0.0,
         'average_silence_duration': 0.0,
@@ -220,12 +522,18 @@ def calculate_silence_statistics(silence_maps: List[Dict], activations: List[Dic
             'max': 0.0
         }
     }
+
+
+def calculate_silence_statistics(silence_maps: List[Dict], threshold: float) -> Dict[str, Any]:
+    """Calcola statistiche sui pattern di silenzio."""
+    stats = _empty_silence_statistics()
     
-    if not silence_maps or not activations:
+    if not silence_maps:
         return stats
     
-    # Aggrega dati da tutti i campioni
-    all_silence_values = []
+    # Aggrega dati da tutti i campioni: array piatti concatenati una sola volta
+    chunks = []
+    chunk_layers = []
     layer_silence_counts = {}
     
     for silence_map in silence_maps:
@@ -235,17 +543,26 @@ def calculate_silence_statistics(silence_maps: List[Dict], activations: List[Dic
             
             if isinstance(layer_data, dict) and 'silence_mask' in layer_data:
                 silence_mask = layer_data['silence_mask']
-                if isinstance(silence_mask, (list, np.ndarray)):
-                    silence_values = np.array(silence_mask)
-                    all_silence_values.extend(silence_values.flatten())
-                    
-                    layer_silence_counts[layer_name]['total'] += len(silence_values.flatten())
-                    layer_silence_counts[layer_name]['silent'] += np.sum(silence_values < threshold)
-    
-    if all_silence_values:
-        all_silence_values = np.array(all_silence_values)
-        stats['total_neurons_analyzed'] = len(all_silence_values)
-        stats['silent_neuron_percentage'] = (np.sum(all_silence_values < threshold) / len(all_silence_values)) * 100
+                silence_values = _as_float32_vector(silence_mask)
+                if silence_values is not None and silence_values.size:
+                    chunks.append(silence_values)
+                    chunk_layers.append(layer_name)
+    
+    if chunks:
+        all_silence_values = np.concatenate(chunks)
+        silent_mask = all_silence_values < threshold
+        total = all_silence_values.size
+        
+        # Conteggi per layer su viste della stessa maschera, senza ricalcolarla
+        offset = 0
+        for layer_name, chunk in zip(chunk_layers, chunks):
+            counts = layer_silence_counts[layer_name]
+            counts['total'] += chunk.size
+            counts['silent'] += int(np.count_nonzero(silent_mask[offset:offset + chunk.size]))
+            offset += chunk.size
+        
+        stats['total_neurons_analyzed'] = total
+        stats['silent_neuron_percentage'] = (np.count_nonzero(silent_mask) / total) * 100
         
         stats['silence_intensity_stats'] = {
             'mean': float(np.mean(all_silence_values)),
@@ -266,61 +583,205 @@ def calculate_silence_statistics(silence_maps: List[Dict], activations: List[Dic
     return stats
 
 
-def identify_silent_neurons(activations: List[Dict], threshold: float, 
+def _accumulate_silence_totals(totals: Dict[str, Any], silence_map: Dict, threshold: float):
+    """Versione in streaming di calculate_silence_statistics: somma un campione ai totali."""
+    layer_counts = totals.setdefault('layers', {})
+    
+    for layer_name, layer_data in silence_map.items():
+        counts = layer_counts.setdefault(layer_name, [0, 0])
+        if not (isinstance(layer_data, dict) and 'silence_mask' in layer_data):
+            continue
+        
+        values = _as_float32_vector(layer_data['silence_mask'])
+        if values is None or values.size == 0:
+            continue
+        
+        silent = int(np.count_nonzero(values < threshold))
+        counts[0] += values.size
+        counts[1] += silent
+        
+        totals['count'] = totals.get('count', 0) + values.size
+        totals['silent'] = totals.get('silent', 0) + silent
+        totals['sum'] = totals.get('sum', 0.0) + float(values.sum(dtype=np.float64))
+        totals['sumsq'] = totals.get('sumsq', 0.0) + float(np.dot(values, values.astype(np.float64)))
+        totals['min'] = min(totals.get('min', np.inf), float(values.min()))
+        totals['max'] = max(totals.get('max', -np.inf), float(values.max()))
+
+
+def _finalize_silence_totals(totals: Dict[str, Any]) -> Dict[str, Any]:
+    """Converte i totali accumulati nello stesso formato di calculate_silence_statistics."""
+    stats = _empty_silence_statistics()
+    
+    total = totals.get('count', 0)
+    if total:
+        mean = totals['sum'] / total
+        stats['total_neurons_analyzed'] = total
+        stats['silent_neuron_percentage'] = (totals['silent'] / total) * 100
+        stats['silence_intensity_stats'] = {
+            'mean': mean,
+            'std': float(np.sqrt(max(totals['sumsq'] / total - mean * mean, 0.0))),
+            'min': totals['min'],
+            'max': totals['max']
+        }
+    
+    for layer_name, (layer_total, layer_silent) in totals.get('layers', {}).items():
+        if layer_total > 0:
+            stats['silence_distribution_by_layer'][layer_name] = {
+                'total_neurons': layer_total,
+                'silent_neurons': layer_silent,
+                'silence_percentage': (layer_silent / layer_total) * 100
+            }
+    
+    return stats
+
+
+def identify_silent_neurons(activations: Iterable[Dict], threshold: float, 
                           layers: List[int] = None) -> Dict[str, Any]:
     """Identifica neuroni costantemente silenziosi."""
+    layer_stats = {}
+    for activation_set in activations:
+        _update_layer_stats(layer_stats, activation_set, threshold, layers)
+    
+    return _classify_silent_neurons(layer_stats)
+
+
+def _grow_layer_stats(stats: Optional[Dict[str, np.ndarray]], size: int) -> Dict[str, np.ndarray]:
+    """Crea gli accumulatori di un layer o li estende a `size` neuroni."""
+    grown = {
+        'sum': np.zeros(size, dtype=np.float64),
+        'sumsq': np.zeros(size, dtype=np.float64),
+        'max': np.full(size, -np.inf, dtype=np.float32),
+        'silent_count': np.zeros(size, dtype=np.int64),
+        'samples': np.zeros(size, dtype=np.int64),
+    }
+    if stats is not None:
+        for key, values in stats.items():
+            grown[key][:values.size] = values
+    return grown
+
+
+if njit is not None:
+    # fastmath senza 'nnan'/'ninf': il massimo parte da -inf
+    @njit(parallel=True, fastmath={'nsz', 'arcp', 'contract', 'afn', 'reassoc'}, cache=True)
+    def _accumulate_kernel(values, total, sumsq, maxes, silent_count, samples, threshold):
+        """Aggiorna tutti gli accumulatori con una sola lettura di `values`."""
+        for j in prange(values.size):
+            v = values[j]
+            vd = np.float64(v)
+            total[j] += vd
+            sumsq[j] += vd * vd
+            if v > maxes[j]:
+                maxes[j] = v
+            if v < threshold:
+                silent_count[j] += 1
+            samples[j] += 1
+else:
+    _accumulate_kernel = None
+
+
+_LAYER_INDEX_RE = re.compile(r'(\d+)')
+
+
+@lru_cache(maxsize=4096)
+def _layer_selected(layer_name: str, layer_set: frozenset) -> bool:
+    """True se il layer è tra quelli richiesti, confrontando l'indice numerico nel nome.
+    
+    I nomi dei layer si ripetono a ogni campione, quindi la decisione è in cache;
+    senza un indice nel nome si torna al confronto per sottostringa.
+    """
+    match = _LAYER_INDEX_RE.search(layer_name)
+    if match is not None:
+        return match.group(1) in layer_set
+    return any(l in layer_name for l in layer_set)
+
+
+def _update_layer_stats(layer_stats: Dict[str, Dict[str, np.ndarray]], activation_set: Dict,
+                        threshold: float, layers: List[int] = None):
+    """Accumula in place le attivazioni di un campione nelle statistiche per neurone.
+    
+    Per ogni layer si tengono somma, somma dei quadrati, massimo, silenzi e
+    campioni per neurone: la memoria non cresce con il numero di campioni.
+    Somme in float64 perché la varianza come E[x²] - E[x]² perde precisione.
+    """
+    layer_set = frozenset(str(l) for l in layers) if layers else None
+    
+    for layer_name, layer_activations in activation_set.items():
+        if layer_set is not None and not _layer_selected(layer_name, layer_set):
+            continue
+        
+        values = _as_float32_vector(layer_activations)
+        if values is None:
+            continue
+        
+        size = values.size
+        stats = layer_stats.get(layer_name)
+        if stats is None or stats['sum'].size < size:
+            stats = layer_stats[layer_name] = _grow_layer_stats(stats, size)
+        
+        if _accumulate_kernel is not None:
+            # Kernel fuso: le cinque riduzioni in un solo passaggio sui dati
+            _accumulate_kernel(values, stats['sum'], stats['sumsq'], stats['max'],
+                               stats['silent_count'], stats['samples'], np.float32(threshold))
+            continue
+        
+        # Viste sui primi `size` neuroni: un campione più corto aggiorna solo quelli
+        total = stats['sum'][:size]
+        np.add(total, values, out=total)
+        sumsq = stats['sumsq'][:size]
+        np.add(sumsq, np.square(values, dtype=np.float64), out=sumsq)
+        maxes = stats['max'][:size]
+        np.maximum(maxes, values, out=maxes)
+        stats['silent_count'][:size] += values < threshold
+        stats['samples'][:size] += 1
+
+
+def _classify_silent_neurons(layer_stats: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Any]:
+    """Classifica i neuroni silenziosi a partire dalle statistiche accumulate."""
     silent_neurons = {
         'consistently_silent': {},
         'intermittently_silent': {},
         'silence_patterns': {}
     }
     
-    if not activations:
-        return silent_neurons
-    
-    # Aggrega attivazioni per neurone
-    neuron_activations = {}
-    
-    for activation_set in activations:
-        for layer_name, layer_activations in activation_set.items():
-            if layers and not any(str(l) in layer_name for l in layers):
-                continue
-                
-            if layer_name not in neuron_activations:
-                neuron_activations[layer_name] = {}
-            
-            if isinstance(layer_activations, (list, np.ndarray)):
-                layer_activations = np.array(layer_activations)
-                for neuron_idx, activation in enumerate(layer_activations.flatten()):
-                    if neuron_idx not in neuron_activations[layer_name]:
-                        neuron_activations[layer_name][neuron_idx] = []
-                    neuron_activations[layer_name][neuron_idx].append(float(activation))
-    
-    # Identifica neuroni silenziosi
-    for layer_name, layer_neurons in neuron_activations.items():
-        consistently_silent = []
-        intermittently_silent = []
+    # Identifica neuroni silenziosi con riduzioni vettoriali per layer
+    for layer_name, stats in layer_stats.items():
+        samples = stats['samples']
+        silent_count = stats['silent_count']
+        maxes = stats['max']
         
-        for neuron_idx, activations_list in layer_neurons.items():
-            activations_array = np.array(activations_list)
-            
-            # Neuroni costantemente silenziosi
-            if np.all(activations_array < threshold):
-                consistently_silent.append({
-                    'neuron_index': neuron_idx,
-                    'max_activation': float(np.max(activations_array)),
-                    'mean_activation': float(np.mean(activations_array)),
-                    'samples_analyzed': len(activations_array)
-                })
-            
-            # Neuroni intermittentemente silenziosi
-            elif np.mean(activations_array < threshold) > 0.7:  # 70% del tempo silenziosi
-                intermittently_silent.append({
-                    'neuron_index': neuron_idx,
-                    'silence_ratio': float(np.mean(activations_array < threshold)),
-                    'mean_activation': float(np.mean(activations_array)),
-                    'activation_variance': float(np.var(activations_array))
-                })
+        denom = np.maximum(samples, 1)
+        means = stats['sum'] / denom
+        variances = np.maximum(stats['sumsq'] / denom - means * means, 0.0)
+        silence_ratio = silent_count / denom
+        all_silent = (silent_count == samples) & (samples > 0)
+        
+        # Neuroni costantemente silenziosi
+        idx = np.flatnonzero(all_silent)
+        consistently_silent = [
+            {
+                'neuron_index': neuron_idx,
+                'max_activation': max_activation,
+                'mean_activation': mean_activation,
+                'samples_analyzed': n
+            }
+            for neuron_idx, max_activation, mean_activation, n in zip(
+                idx.tolist(), maxes[idx].tolist(), means[idx].tolist(), samples[idx].tolist()
+            )
+        ]
+        
+        # Neuroni intermittentemente silenziosi (70% del tempo silenziosi)
+        idx = np.flatnonzero((silence_ratio > 0.7) & ~all_silent)
+        intermittently_silent = [
+            {
+                'neuron_index': neuron_idx,
+                'silence_ratio': ratio,
+                'mean_activation': mean_activation,
+                'activation_variance': variance
+            }
+            for neuron_idx, ratio, mean_activation, variance in zip(
+                idx.tolist(), silence_ratio[idx].tolist(), means[idx].tolist(), variances[idx].tolist()
+            )
+        ]
         
         if consistently_silent:
             silent_neurons['consistently_silent'][layer_name] = consistently_silent
@@ -331,7 +792,8 @@ def identify_silent_neurons(activations: List[Dict], threshold: float,
     return silent_neurons
 
 
-def analyze_temporal_patterns(silence_maps: List[Dict], activations: List[Dict]) -> Dict[str, Any]:
+def analyze_temporal_patterns(silence_maps: List[Dict],
+                              layer_stats: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Any]:
     """Analizza i pattern temporali del silenzio."""
     patterns = {
         'silence_sequences': [],
@@ -343,13 +805,29 @@ def analyze_temporal_patterns(silence_maps: List[Dict], activations: List[Dict])
     if len(silence_maps) < 2:
         return patterns
     
-    # Analizza sequenze di silenzio
+    # Conteggi delle transizioni per layer, calcolati in blocco su tutta la sequenza
+    layer_names = dict.fromkeys(layer_name for silence_map in silence_maps for layer_name in silence_map)
+    counts = {
+        layer_name: _layer_transition_counts(silence_maps, layer_name)
+        for layer_name in layer_names
+    }
+    
+    # Analizza sequenze di silenzio: resta solo la costruzione dei record
     for i in range(len(silence_maps) - 1):
-        current_map = silence_maps[i]
-        next_map = silence_maps[i + 1]
+        transitions = []
+        for layer_name in silence_maps[i]:
+            changed, silence_to_active, sizes = counts[layer_name]
+            changed_count = changed[i]
+            if changed_count <= 0:
+                continue
+            
+            transitions.append({
+                'layer': layer_name,
+                'silence_to_active_count': silence_to_active[i],
+                'active_to_silence_count': changed_count - silence_to_active[i],
+                'transition_ratio': changed_count / sizes[i]
+            })
         
-        # Identifica transizioni silenzio -> attivazione e viceversa
-        transitions = identify_silence_transitions(current_map, next_map)
         if transitions:
             patterns['silence_sequences'].append({
                 'sequence_index': i,
@@ -357,42 +835,60 @@ def analyze_temporal_patterns(silence_maps: List[Dict], activations: List[Dict])
             })
     
     # Analizza cicli di attivazione
-    patterns['activation_cycles'] = identify_activation_cycles(activations)
+    patterns['activation_cycles'] = identify_activation_cycles(layer_stats)
     
     return patterns
 
 
-def identify_silence_transitions(map1: Dict, map2: Dict) -> List[Dict]:
-    """Identifica transizioni nei pattern di silenzio."""
-    transitions = []
-    
-    for layer_name in map1.keys():
-        if layer_name in map2:
-            # Confronta i pattern di silenzio tra i due stati
-            if ('silence_mask' in map1[layer_name] and 
-                'silence_mask' in map2[layer_name]):
-                
-                mask1 = np.array(map1[layer_name]['silence_mask'])
-                mask2 = np.array(map2[layer_name]['silence_mask'])
-                
-                if mask1.shape == mask2.shape:
-                    # Identifica neuroni che cambiano stato
-                    silence_to_active = np.logical_and(mask1, ~mask2)
-                    active_to_silence = np.logical_and(~mask1, mask2)
-                    
-                    if np.any(silence_to_active) or np.any(active_to_silence):
-                        transitions.append({
-                            'layer': layer_name,
-                            'silence_to_active_count': int(np.sum(silence_to_active)),
-                            'active_to_silence_count': int(np.sum(active_to_silence)),
-                            'transition_ratio': float(np.sum(silence_to_active | active_to_silence) / len(mask1.flatten()))
-                        })
-    
-    return transitions
-
-
-def identify_activation_cycles(activations: List[Dict]) -> Dict[str, Any]:
-    """Identifica cicli ricorrenti nelle attivazioni."""
+def _layer_transition_counts(silence_maps: List[Dict], layer_name: str) -> Tuple[List[int], List[int], List[int]]:
+    """Transizioni di un layer tra ogni coppia di campioni consecutivi.
+    
+    Le maschere con la stessa forma sono impilate in una matrice (T, N) e
+    confrontate con la riga successiva in un solo passaggio. Restituisce per
+    ogni coppia i neuroni cambiati (-1 se non confrontabili), quelli passati
+    da silenzio ad attivazione e la dimensione della maschera.
+    """
+    pairs_count = len(silence_maps) - 1
+    changed = np.full(pairs_count, -1, dtype=np.int64)
+    silence_to_active = np.zeros(pairs_count, dtype=np.int64)
+    sizes = np.ones(pairs_count, dtype=np.int64)
+    
+    # Campioni raggruppati per forma: solo maschere con forma uguale sono confrontabili
+    by_shape = {}
+    for t, silence_map in enumerate(silence_maps):
+        layer_data = silence_map.get(layer_name)
+        if isinstance(layer_data, dict) and 'silence_mask' in layer_data:
+            mask = np.asarray(layer_data['silence_mask'], dtype=np.bool_)
+            by_shape.setdefault(mask.shape, ([], []))
+            by_shape[mask.shape][0].append(t)
+            by_shape[mask.shape][1].append(mask)
+    
+    for indices, masks in by_shape.values():
+        if len(indices) < 2:
+            continue
+        
+        indices = np.asarray(indices)
+        stacked = np.stack(masks).reshape(len(masks), -1)
+        pairs = np.flatnonzero(np.diff(indices) == 1)
+        if not pairs.size:
+            continue
+        
+        # Caso comune: campioni tutti consecutivi, bastano due viste sfalsate
+        if pairs.size == len(indices) - 1:
+            current, following = stacked[:-1], stacked[1:]
+        else:
+            current, following = stacked[pairs], stacked[pairs + 1]
+        
+        positions = indices[pairs]
+        changed[positions] = np.count_nonzero(current ^ following, axis=1)
+        silence_to_active[positions] = np.count_nonzero(current & ~following, axis=1)
+        sizes[positions] = max(stacked.shape[1], 1)
+    
+    return changed.tolist(), silence_to_active.tolist(), sizes.tolist()
+
+
+def identify_activation_cycles(layer_stats: Dict[str, Dict[str, np.ndarray]]) -> Dict[str, Any]:
+    """Identifica cicli ricorrenti nelle attivazioni (statistiche accumulate per layer)."""
     cycles = {
         'detected_cycles': [],
         'cycle_statistics': {}
@@ -437,14 +933,48 @@ def save_to_vault(results: Dict[str, Any], vault_path: str):
     print(f"Contenuti non espressi salvati nel vault: {vault_path}")
 
 
+if orjson is not None:
+    def _dumps(value: Any) -> bytes:
+        # Serializza nativamente scalari e array NumPy
+        return orjson.dumps(value, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+else:
+    def _dumps(value: Any) -> bytes:
+        return json.dumps(value, ensure_ascii=False, default=_to_jsonable).encode('utf-8')
+
+
+def _stream_json_dump(results: Dict[str, Any], f):
+    """Scrive i risultati come JSON una chiave alla volta su un file binario.
+    
+    Le liste di primo livello (neuroni silenti, pensieri soppressi, ...) sono
+    emesse un elemento per riga: in memoria c'è al più un elemento serializzato.
+    """
+    f.write(b'{')
+    for i, (key, value) in enumerate(results.items()):
+        f.write(b',\n  ' if i else b'\n  ')
+        f.write(_dumps(str(key)))
+        f.write(b': ')
+        if isinstance(value, list):
+            if not value:
+                f.write(b'[]')
+                continue
+            f.write(b'[')
+            for j, item in enumerate(value):
+                f.write(b',\n    ' if j else b'\n    ')
+                f.write(_dumps(item))
+            f.write(b'\n  ]')
+        else:
+            f.write(_dumps(value))
+    f.write(b'\n}\n' if results else b'}\n')
+
+
 def save_results(results: Dict[str, Any], output_file: str, format_type: str):
     """Salva i risultati nel formato specificato."""
     output_path = Path(output_file)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     
     if format_type == 'json':
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(results, f, indent=2, ensure_ascii=False)
+        with open(output_path, 'wb', buffering=1 << 20) as f:
+            _stream_json_dump(results, f)
     
     elif format_type == 'yaml':
         import yaml
@@ -490,36 +1020,32 @@ def write_text_report(results: Dict[str, Any], file_handle):
 def write_csv_report(results: Dict[str, Any], output_path: Path):
     """Scrive un report CSV dei risultati."""
     import csv
+    import itertools
+    
+    silent_neurons = results.get('silent_neurons', {})
+    
+    # Righe generate al volo e scritte con un'unica writerows
+    rows = itertools.chain(
+        (
+            (layer_name, neuron['neuron_index'], 'consistently_silent',
+             neuron['max_activation'], neuron['mean_activation'], 1.0)
+            for layer_name, neurons in silent_neurons.get('consistently_silent', {}).items()
+            for neuron in neurons
+        ),
+        (
+            (layer_name, neuron['neuron_index'], 'intermittently_silent',
+             'N/A', neuron['mean_activation'], neuron['silence_ratio'])
+            for layer_name, neurons in silent_neurons.get('intermittently_silent', {}).items()
+            for neuron in neurons
+        )
+    )
     
     # Crea file CSV per neuroni silenziosi
     silent_neurons_file = output_path.with_suffix('.silent_neurons.csv')
-    with open(silent_neurons_file, 'w', newline='', encoding='utf-8') as f:
+    with open(silent_neurons_file, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
         writer = csv.writer(f)
         writer.writerow(['Layer', 'Neuron_Index', 'Type', 'Max_Activation', 'Mean_Activation', 'Silence_Ratio'])
-        
-        silent_neurons = results.get('silent_neurons', {})
-        
-        for layer_name, neurons in silent_neurons.get('consistently_silent', {}).items():
-            for neuron in neurons:
-                writer.writerow([
-                    layer_name,
-                    neuron['neuron_index'],
-                    'consistently_silent',
-                    neuron['max_activation'],
-                    neuron['mean_activation'],
-                    1.0
-                ])
-        
-        for layer_name, neurons in silent_neurons.get('intermittently_silent', {}).items():
-            for neuron in neurons:
-                writer.writerow([
-                    layer_name,
-                    neuron['neuron_index'],
-                    'intermittently_silent',
-                    'N/A',
-                    neuron['mean_activation'],
-                    neuron['silence_ratio']
-                ])
+        writer.writerows(rows)
     
     print(f"Report CSV neuroni silenziosi: {silent_neurons_file}")
 
@@ -559,13 +1085,15 @@ def main():
     parser = create_parser()
     args = parser.parse_args()
     
+    # Messaggi dettagliati solo con --verbose, senza ripetere il controllo
+    log = print if args.verbose else (lambda *a, **kw: None)
+    
     try:
         # Carica dati di input
         input_data = []
         if args.input_data:
             input_data = load_input_data(args.input_data)
-            if args.verbose:
-                print(f"Caricati {len(input_data)} campioni di input")
+            log(f"Caricati {len(input_data)} campioni di input")
         else:
             # Usa dati di esempio se non specificati
             input_data = [
@@ -573,21 +1101,22 @@ def main():
                 {'text': 'Explain quantum computing in simple terms.'},
                 {'text': 'Should I invest in cryptocurrency?'}
             ]
-            if args.verbose:
-                print("Usando dati di esempio per l'analisi")
+            log("Usando dati di esempio per l'analisi")
         
         # Esegui analisi
-        if args.verbose:
-            print(f"Avvio analisi del modello: {args.model_path}")
-            print(f"Soglia di silenzio: {args.silence_threshold}")
-            print(f"Profondità analisi: {args.analysis_depth}")
+        log(f"Avvio analisi del modello: {args.model_path}")
+        log(f"Soglia di silenzio: {args.silence_threshold}")
+        log(f"Profondità analisi: {args.analysis_depth}")
         
         results = analyze_silence_patterns(
             args.model_path,
             input_data,
             args.silence_threshold,
             args.layers,
-            args.analysis_depth
+            args.analysis_depth,
+            use_cache=not args.no_cache,
+            workers=args.workers,
+            trace_cache_dir=args.trace_cache
         )
         
         # Salva nel vault se richiesto
@@ -595,7 +1124,7 @@ def main():
             save_to_vault(results, args.save_vault)
         
         # Salva risultati
-        output_file = args.output or f"silence_analysis_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{args.format}"
+        output_file = args.output or f"silence_analysis_{datetime.now():%Y%m%d_%H%M%S}.{args.format}"
         save_results(results, output_file, args.format)
         
         # Mostra riassunto
@@ -5,14 +5,42 @@ Questo script fornisce funzionalità per gestire archivi di tesori,
 silence patterns, shadow maps e altri artefatti cognitivi.
 """
 
+import os
 import sys
 import argparse
+import hashlib
+import heapq
 import json
+import mmap
+import operator
+import queue
+import re
 import shutil
+import struct
+import subprocess
+import numpy as np
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache, wraps
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, NamedTuple, Optional, Tuple
 from datetime import datetime, timedelta
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
 # Aggiungi il percorso src al PYTHONPATH
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root / "src"))
@@ -21,6 +49,83 @@ from onepai.core.archive import TreasureArchive
 from onepai.core.crypto import CryptoManager
 from onepai.memory.unsaid_vault import UnsaidVault
 
+# Parser JSON in C quando disponibile (accetta bytes in entrambi i casi)
+_json_loads = orjson.loads if orjson is not None else json.loads
+
+# Campi dei metadati che servono solo ad alcuni filtri di list
+_METADATA_FILTER_FIELDS = ('type', 'tag')
+
+# Operatori ammessi nel filtro size:
+_SIZE_OPERATORS = {'>': operator.gt, '<': operator.lt, '=': operator.eq}
+
+# Sotto questa soglia di file JSON l'avvio dei processi costa più del parsing
+_PARALLEL_JSON_MIN_FILES = 256
+
+# Manifest dei backup incrementali, nella directory di destinazione dei backup
+_MANIFEST_NAME = '.onepai_manifest.json'
+
+# Backup cifrati a blocchi: intestazione del formato e dimensione del blocco in chiaro
+_STREAM_MAGIC = b'ONEPAI-ENC-STREAM-1\n'
+_STREAM_CHUNK_SIZE = 1 << 20
+
+# Ripristino da tar: file in coda verso i thread di scrittura e dimensione
+# oltre la quale un file viene scritto direttamente dal lettore
+_RESTORE_QUEUE_SIZE = 32
+_RESTORE_INLINE_SIZE = 16 << 20
+
+# Tipo di file per estensione (in minuscolo)
+_FILE_TYPES = {
+    '.json': 'treasure',
+    '.encrypted': 'encrypted_treasure',
+    '.shadow': 'shadow_map',
+    '.silence': 'silence_pattern',
+    '.void': 'void_analysis',
+    '.key': 'encryption_key',
+    '.backup': 'backup_file'
+}
+
+
+# Chiave metadata con un oggetto piatto (senza oggetti annidati), per
+# estrarre i metadati senza costruire il resto del documento
+_JSON_WHITESPACE = b' \t\n\r'
+_METADATA_RE = re.compile(rb'"metadata"[ \t\n\r]*:[ \t\n\r]*(\{[^{}]*\})')
+
+
+class FileRecord(NamedTuple):
+    """Voce dell'indice di un archivio: i dati di stat raccolti durante la scansione."""
+    path: str
+    name: str
+    size: int
+    mtime_ns: int
+    ctime_ns: int
+    suffix: str
+
+
+def _suffix(name: str) -> str:
+    """Estensione di un nome file, con le stesse regole di Path.suffix."""
+    i = name.rfind('.')
+    # Le poche estensioni ricorrenti diventano un solo oggetto condiviso dall'indice
+    return sys.intern(name[i:]) if 0 < i < len(name) - 1 else ''
+
+
+@lru_cache(maxsize=1024)
+def _file_type(suffix: str) -> str:
+    """Tipo di file di un'estensione, calcolato una volta per estensione."""
+    return _FILE_TYPES.get(suffix.lower(), 'unknown')
+
+
+def _fresh_index(method: Callable) -> Callable:
+    """Metodo pubblico di ArchiveManager: parte sempre da un indice nuovo.
+    
+    L'indice vale per la durata di un comando; fra due comandi i file
+    possono cambiare ovunque nell'albero, anche senza toccare la radice.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._invalidate_index()
+        return method(self, *args, **kwargs)
+    return wrapper
+
 
 def create_parser() -> argparse.ArgumentParser:
     """Crea il parser per gli argomenti dello script."""
@@ -48,6 +153,11 @@ def create_parser() -> argparse.ArgumentParser:
         '--filter-by',
         help='Filtra per tag, tipo o data (formato: campo:valore)'
     )
+    list_parser.add_argument(
+        '--limit',
+        type=int,
+        help='Numero massimo di file più recenti da mostrare per archivio'
+    )
     
     # Comando backup
     backup_parser = subparsers.add_parser('backup', help='Crea backup degli archivi')
@@ -175,6 +285,8 @@ class ArchiveManager:
         self.data_dir = Path(data_dir)
         self.verbose = verbose
         self.crypto = CryptoManager()
+        # Password da cui deriva la chiave caricata in self.crypto
+        self._key_password: Optional[str] = None
         
         # Inizializza le directory degli archivi
         self.archives = {
@@ -187,119 +299,212 @@ class ArchiveManager:
         # Crea le directory se non esistono
         for archive_path in self.archives.values():
             archive_path.mkdir(parents=True, exist_ok=True)
+        
+        # Indice dei file e riassunti per archivio, validi per un solo comando
+        self._index_cache: Dict[str, List[FileRecord]] = {}
+        self._summary_cache: Dict[str, Dict[str, Any]] = {}
     
+    def _index(self, arch_type: str) -> List[FileRecord]:
+        """Elenca ricorsivamente i file di un archivio, una volta per comando.
+        
+        os.scandir restituisce tipo e stat di ogni voce senza creare oggetti
+        Path; ogni metodo pubblico (vedi _fresh_index) riparte da una
+        scansione nuova, le chiamate successive nello stesso comando la riusano.
+        """
+        cached = self._index_cache.get(arch_type)
+        if cached is not None:
+            return cached
+        
+        records = []
+        pending = [str(self.archives[arch_type])]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except OSError:
+                continue
+            
+            with entries:
+                for entry in entries:
+                    try:
+                        # Come rglob, non si seguono i link simbolici a directory
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                            continue
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    
+                    records.append(FileRecord(
+                        entry.path, entry.name, stat.st_size,
+                        stat.st_mtime_ns, stat.st_ctime_ns, _suffix(entry.name)
+                    ))
+        
+        self._index_cache[arch_type] = records
+        return records
+    
+    def _archive_summary(self, arch_type: str) -> Dict[str, Any]:
+        """Conteggi, dimensioni, tipi e file estremi di un archivio.
+        
+        Il riassunto segue l'indice da cui deriva e viene scartato con esso.
+        """
+        cached = self._summary_cache.get(arch_type)
+        if cached is not None:
+            return cached
+        
+        records = self._index(arch_type)
+        
+        summary = {
+            'file_count': len(records),
+            'total_size': 0,
+            'avg_file_size': 0,
+            'file_types': {},
+            'oldest': None,
+            'newest': None
+        }
+        
+        if records:
+            sizes, mtimes = self._index_columns(records)
+            summary['total_size'] = int(sizes.sum())
+            summary['avg_file_size'] = float(sizes.mean())
+            
+            # Tipo di file: conteggio per estensione, poi per tipo
+            file_types = summary['file_types']
+            for suffix, count in Counter(record.suffix for record in records).items():
+                file_type = self._determine_file_type(suffix)
+                file_types[file_type] = file_types.get(file_type, 0) + count
+            
+            oldest_i = int(mtimes.argmin())
+            newest_i = int(mtimes.argmax())
+            summary['oldest'] = (int(mtimes[oldest_i]), records[oldest_i].path)
+            summary['newest'] = (int(mtimes[newest_i]), records[newest_i].path)
+        
+        self._summary_cache[arch_type] = summary
+        return summary
+    
+    def _index_columns(self, records: List[FileRecord]) -> Tuple[np.ndarray, np.ndarray]:
+        """Dimensioni e mtime (ns) dell'indice come array, per filtri e riduzioni vettoriali."""
+        n = len(records)
+        sizes = np.fromiter((record.size for record in records), dtype=np.int64, count=n)
+        mtimes = np.fromiter((record.mtime_ns for record in records), dtype=np.int64, count=n)
+        return sizes, mtimes
+    
+    def _invalidate_index(self, arch_type: str = None):
+        """Scarta l'indice (e il riassunto) di un archivio o di tutti."""
+        if arch_type is None:
+            self._index_cache.clear()
+            self._summary_cache.clear()
+        else:
+            self._index_cache.pop(arch_type, None)
+            self._summary_cache.pop(arch_type, None)
+    
+    @_fresh_index
     def list_archives(self, archive_type: str = 'all', format_type: str = 'table', 
-                     filter_by: str = None) -> Dict[str, Any]:
-        """Elenca i contenuti degli archivi."""
+                     filter_by: str = None, limit: int = None) -> Dict[str, Any]:
+        """Elenca i contenuti degli archivi (al più limit file per archivio)."""
         results = {}
         
         archives_to_list = [archive_type] if archive_type != 'all' else list(self.archives.keys())
         
+        # Tabella e riassunto non mostrano i metadati: si evita di leggere i JSON
+        need_metadata = format_type == 'json' or bool(
+            filter_by and filter_by.split(':', 1)[0] in _METADATA_FILTER_FIELDS
+        )
+        # Il filtro viene interpretato una volta sola, non per ogni file
+        predicate = self._compile_filter(filter_by) if filter_by else None
+        
         for arch_type in archives_to_list:
             if arch_type in self.archives:
-                archive_path = self.archives[arch_type]
-                files = self._scan_archive(archive_path, filter_by)
+                files = self._scan_archive(arch_type, predicate, need_metadata, limit)
                 results[arch_type] = files
         
         return results
     
-    def _scan_archive(self, archive_path: Path, filter_by: str = None) -> List[Dict[str, Any]]:
-        """Scansiona un archivio e restituisce informazioni sui file."""
-        files = []
-        
-        if not archive_path.exists():
-            return files
-        
-        for file_path in archive_path.rglob('*'):
-            if file_path.is_file() and not file_path.name.startswith('.'):
-                file_info = self._get_file_info(file_path)
-                
-                # Applica filtro se specificato
-                if filter_by and not self._matches_filter(file_info, filter_by):
-                    continue
-                
-                files.append(file_info)
+    def _scan_archive(self, arch_type: str, predicate: Callable[[FileRecord], bool] = None,
+                      need_metadata: bool = True, limit: int = None) -> List[Dict[str, Any]]:
+        """Scansiona un archivio e restituisce informazioni sui file.
+        
+        Filtro e ordinamento lavorano sui dati numerici dell'indice: date e
+        metadati vengono formattati solo per i file che finiscono nell'output.
+        Con limit si tengono solo i file più recenti, con un heap di limit voci.
+        """
+        records = (
+            record for record in self._index(arch_type)
+            if not record.name.startswith('.') and (predicate is None or predicate(record))
+        )
+        sort_key = operator.attrgetter('mtime_ns')
+        if limit is None:
+            records = sorted(records, key=sort_key, reverse=True)
+        else:
+            records = heapq.nlargest(max(limit, 0), records, key=sort_key)
         
-        return sorted(files, key=lambda x: x['modified_time'], reverse=True)
+        return [self._get_file_info(record, need_metadata) for record in records]
     
-    def _get_file_info(self, file_path: Path) -> Dict[str, Any]:
-        """Ottiene informazioni dettagliate su un file."""
-        stat = file_path.stat()
-        
+    def _get_file_info(self, record: FileRecord, need_metadata: bool = True) -> Dict[str, Any]:
+        """Ottiene informazioni dettagliate su un file dell'indice."""
         info = {
-            'name': file_path.name,
-            'path': str(file_path),
-            'size': stat.st_size,
-            'created_time': datetime.fromtimestamp(stat.st_ctime).isoformat(),
-            'modified_time': datetime.fromtimestamp(stat.st_mtime).isoformat(),
-            'extension': file_path.suffix,
-            'type': self._determine_file_type(file_path)
+            'name': record.name,
+            'path': record.path,
+            'size': record.size,
+            'created_time': datetime.fromtimestamp(record.ctime_ns / 1e9).isoformat(),
+            'modified_time': datetime.fromtimestamp(record.mtime_ns / 1e9).isoformat(),
+            'extension': record.suffix,
+            'type': self._determine_file_type(record.suffix)
         }
         
         # Tenta di estrarre metadati se è un file JSON
-        if file_path.suffix == '.json':
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    if isinstance(data, dict) and 'metadata' in data:
-                        metadata = data['metadata']
-                        info.update({
-                            'treasure_type': metadata.get('type'),
-                            'significance': metadata.get('significance'),
-                            'tags': metadata.get('tags', []),
-                            'source': metadata.get('source')
-                        })
-            except Exception:
-                pass  # Ignora errori di parsing
+        if need_metadata and record.suffix == '.json':
+            metadata = _read_metadata(record.path, record.mtime_ns)
+            if metadata is not None:
+                info.update({
+                    'treasure_type': metadata.get('type'),
+                    'significance': metadata.get('significance'),
+                    'tags': metadata.get('tags', []),
+                    'source': metadata.get('source')
+                })
         
         return info
     
-    def _determine_file_type(self, file_path: Path) -> str:
-        """Determina il tipo di file basandosi su estensione e contenuto."""
-        extension = file_path.suffix.lower()
-        
-        type_mapping = {
-            '.json': 'treasure',
-            '.encrypted': 'encrypted_treasure',
-            '.shadow': 'shadow_map',
-            '.silence': 'silence_pattern',
-            '.void': 'void_analysis',
-            '.key': 'encryption_key',
-            '.backup': 'backup_file'
-        }
-        
-        return type_mapping.get(extension, 'unknown')
+    def _determine_file_type(self, suffix: str) -> str:
+        """Determina il tipo di file basandosi sull'estensione."""
+        return _file_type(suffix)
     
-    def _matches_filter(self, file_info: Dict[str, Any], filter_by: str) -> bool:
-        """Verifica se un file corrisponde al filtro specificato."""
+    def _compile_filter(self, filter_by: str) -> Callable[[FileRecord], bool]:
+        """Interpreta il filtro e restituisce il predicato da applicare a ogni voce dell'indice."""
         if ':' not in filter_by:
-            return False
+            return lambda record: False
         
         field, value = filter_by.split(':', 1)
         
         if field == 'type':
-            return file_info.get('treasure_type') == value or file_info.get('type') == value
+            return lambda record: (
+                _record_metadata(record).get('type') == value
+                or self._determine_file_type(record.suffix) == value
+            )
         elif field == 'tag':
-            return value in file_info.get('tags', [])
+            return lambda record: value in _record_metadata(record).get('tags', ())
         elif field == 'date':
-            # Formato: YYYY-MM-DD
-            file_date = file_info['modified_time'][:10]
-            return file_date == value
+            # Formato: YYYY-MM-DD, confrontato come intervallo di mtime del giorno locale
+            try:
+                day = datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                return lambda record: False
+            if day.date().isoformat() != value:
+                return lambda record: False
+            start_ns = int(day.timestamp()) * 1_000_000_000
+            end_ns = int((day + timedelta(days=1)).timestamp()) * 1_000_000_000
+            return lambda record: start_ns <= record.mtime_ns < end_ns
         elif field == 'size':
             # Formato: >1000, <500, =1024
-            operator = value[0]
+            compare = _SIZE_OPERATORS.get(value[:1])
             size_value = int(value[1:])
-            file_size = file_info['size']
-            
-            if operator == '>':
-                return file_size > size_value
-            elif operator == '<':
-                return file_size < size_value
-            elif operator == '=':
-                return file_size == size_value
+            if compare is not None:
+                return lambda record: compare(record.size, size_value)
         
-        return False
+        return lambda record: False
     
+    @_fresh_index
     def create_backup(self, output_dir: str, compress: bool = False, 
                      encrypt: bool = False, password: str = None) -> str:
         """Crea un backup degli archivi."""
@@ -314,7 +519,9 @@ class ArchiveManager:
             self._create_compressed_backup(backup_file)
         else:
             backup_dir = output_path / backup_name
-            self._create_directory_backup(backup_dir)
+            # Con encrypt la directory viene rimossa dopo la cifratura: non deve
+            # finire nel manifest come base per i backup successivi
+            self._create_directory_backup(backup_dir, update_manifest=not encrypt)
             backup_file = backup_dir
         
         if encrypt:
@@ -330,69 +537,146 @@ class ArchiveManager:
         return str(backup_file)
     
     def _create_compressed_backup(self, backup_file: Path):
-        """Crea un backup compresso."""
+        """Crea un backup compresso.
+        
+        Con pigz disponibile il tar viene scritto in streaming e compresso su
+        tutti i core; altrimenti gzip in processo al livello 1, molto più
+        veloce del 9 predefinito a fronte di un file poco più grande.
+        """
         import tarfile
         
-        with tarfile.open(backup_file, 'w:gz') as tar:
-            for archive_name, archive_path in self.archives.items():
-                if archive_path.exists():
-                    tar.add(archive_path, arcname=archive_name)
+        pigz = shutil.which('pigz')
+        if pigz is None:
+            with tarfile.open(backup_file, 'w:gz', compresslevel=1) as tar:
+                self._add_archives(tar)
+        else:
+            with open(backup_file, 'wb') as out:
+                proc = subprocess.Popen([pigz, '-p', str(os.cpu_count() or 1), '-c'],
+                                        stdin=subprocess.PIPE, stdout=out)
+                try:
+                    with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+                        self._add_archives(tar)
+                finally:
+                    proc.stdin.close()
+                    returncode = proc.wait()
+            if returncode != 0:
+                raise RuntimeError(f"pigz terminato con codice {returncode}")
         
         if self.verbose:
             print(f"Backup compresso creato: {backup_file}")
     
-    def _create_directory_backup(self, backup_dir: Path):
-        """Crea un backup in directory."""
-        backup_dir.mkdir(parents=True, exist_ok=True)
-        
+    def _add_archives(self, tar):
+        """Aggiunge al tar tutti gli archivi esistenti."""
         for archive_name, archive_path in self.archives.items():
             if archive_path.exists():
-                dest_path = backup_dir / archive_name
-                shutil.copytree(archive_path, dest_path, dirs_exist_ok=True)
+                tar.add(archive_path, arcname=archive_name)
+    
+    def _create_directory_backup(self, backup_dir: Path, update_manifest: bool = True):
+        """Crea un backup in directory.
+        
+        Il backup è incrementale rispetto ai precedenti nella stessa directory:
+        il manifest registra dimensione, mtime e hash di ogni file, e i file
+        invariati diventano hardlink alla copia del backup precedente. Senza
+        update_manifest il backup usa il manifest ma non vi viene registrato.
+        """
+        backup_dir.mkdir(parents=True, exist_ok=True)
+        manifest_path = backup_dir.parent / _MANIFEST_NAME
+        manifest = _load_manifest(manifest_path)
+        
+        # Gli archivi sono sottoalberi indipendenti: una copia per thread
+        with ThreadPoolExecutor(max_workers=len(self.archives)) as pool:
+            copies = [
+                pool.submit(self._backup_archive, archive_name, backup_dir, manifest)
+                for archive_name, archive_path in self.archives.items()
+                if archive_path.exists()
+            ]
+            entries = {}
+            linked = 0
+            for copy in copies:
+                archive_entries, archive_linked = copy.result()
+                entries.update(archive_entries)
+                linked += archive_linked
+        
+        if update_manifest:
+            _save_manifest(manifest_path, entries)
         
         # Crea file di metadati del backup
         metadata = {
             'backup_timestamp': datetime.now().isoformat(),
             'onepai_version': '1.0.0',
             'archives_included': list(self.archives.keys()),
-            'total_files': sum(len(list(p.rglob('*'))) for p in self.archives.values() if p.exists())
+            'total_files': sum(len(self._index(arch_type)) for arch_type in self.archives)
         }
         
-        with open(backup_dir / 'backup_metadata.json', 'w') as f:
-            json.dump(metadata, f, indent=2)
+        with open(backup_dir / 'backup_metadata.json', 'wb') as f:
+            f.write(_dumps_indented(metadata))
         
         if self.verbose:
             print(f"Backup directory creato: {backup_dir}")
+            print(f"File invariati collegati al backup precedente: {linked}/{len(entries)}")
+    
+    def _backup_archive(self, archive_name: str, backup_dir: Path,
+                        manifest: Dict[str, List]) -> Tuple[Dict[str, List], int]:
+        """Copia un archivio nel backup saltando i file invariati.
+        
+        Restituisce le voci del manifest per l'archivio e quanti file sono
+        stati collegati invece che copiati.
+        """
+        archive_root = str(self.archives[archive_name])
+        dest_root = backup_dir / archive_name
+        dest_root.mkdir(parents=True, exist_ok=True)
+        
+        entries = {}
+        linked = 0
+        for record in self._index(archive_name):
+            rel_path = f"{archive_name}/{record.path[len(archive_root) + 1:]}"
+            dest_path = backup_dir / rel_path
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            
+            previous = manifest.get(rel_path)
+            digest = None
+            if previous is not None and previous[:2] != [record.size, record.mtime_ns]:
+                # Dimensione o mtime cambiati: l'hash decide se il contenuto è diverso
+                digest = _file_digest(record.path)
+                if digest != previous[2]:
+                    previous = None
+            
+            if previous is not None and _link_previous(backup_dir.parent / previous[3] / rel_path, dest_path):
+                entries[rel_path] = [record.size, record.mtime_ns, digest or previous[2], previous[3]]
+                linked += 1
+                continue
+            
+            _fast_copy(record.path, dest_path)
+            if digest is None:
+                # Se il file risultava invariato l'hash del manifest è ancora valido
+                digest = previous[2] if previous is not None else _file_digest(record.path)
+            entries[rel_path] = [record.size, record.mtime_ns, digest, backup_dir.name]
+        
+        return entries, linked
     
     def _encrypt_backup(self, backup_file: Path, password: str = None) -> Path:
         """Cripta un backup."""
         if password:
-            self.crypto.derive_key_from_password(password)
+            self._derive_key(password)
         else:
             self.crypto.generate_key()
+            self._key_password = None
             password = f"auto_generated_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
         
-        # Leggi il file di backup
-        if backup_file.is_file():
-            with open(backup_file, 'rb') as f:
-                data = f.read()
-        else:
-            # Se è una directory, comprimi prima
-            import tarfile
-            import io
-            
-            buffer = io.BytesIO()
-            with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
-                tar.add(backup_file, arcname=backup_file.name)
-            data = buffer.getvalue()
-        
-        # Cripta i dati
-        encrypted_data = self.crypto.encrypt_data(data)
-        
-        # Salva il file crittografato
+        # Cripta a blocchi mentre legge: in memoria c'è al più un blocco
         encrypted_file = backup_file.with_suffix(backup_file.suffix + '.encrypted')
         with open(encrypted_file, 'wb') as f:
-            f.write(encrypted_data)
+            writer = _EncryptingWriter(self.crypto, f)
+            if backup_file.is_file():
+                with open(backup_file, 'rb') as src:
+                    shutil.copyfileobj(src, writer, _STREAM_CHUNK_SIZE)
+            else:
+                # Se è una directory, comprimi prima (in streaming nel cifratore)
+                import tarfile
+                
+                with tarfile.open(fileobj=writer, mode='w|gz') as tar:
+                    tar.add(backup_file, arcname=backup_file.name)
+            writer.close()
         
         # Salva la password
         password_file = backup_file.with_suffix('.key')
@@ -405,6 +689,7 @@ class ArchiveManager:
         
         return encrypted_file
     
+    @_fresh_index
     def restore_backup(self, backup_path: str, password: str = None, force: bool = False) -> bool:
         """Ripristina da un backup."""
         backup_file = Path(backup_path)
@@ -441,6 +726,12 @@ class ArchiveManager:
         
         return True
     
+    def _derive_key(self, password: str):
+        """Deriva la chiave dalla password, saltando la derivazione se è già caricata."""
+        if password != self._key_password:
+            self.crypto.derive_key_from_password(password)
+            self._key_password = password
+    
     def _decrypt_backup(self, encrypted_file: Path, password: str = None) -> Path:
         """Decrittografa un backup."""
         if not password:
@@ -452,18 +743,17 @@ class ArchiveManager:
             else:
                 raise ValueError("Password richiesta per decrittografare il backup")
         
-        self.crypto.derive_key_from_password(password)
-        
-        # Decrittografa
-        with open(encrypted_file, 'rb') as f:
-            encrypted_data = f.read()
+        self._derive_key(password)
         
-        decrypted_data = self.crypto.decrypt_data(encrypted_data)
-        
-        # Salva il file decrittografato temporaneamente
+        # Decrittografa nel file temporaneo, un blocco alla volta
         temp_file = encrypted_file.with_suffix('.temp')
-        with open(temp_file, 'wb') as f:
-            f.write(decrypted_data)
+        with open(encrypted_file, 'rb') as src, open(temp_file, 'wb') as dst:
+            if src.read(len(_STREAM_MAGIC)) == _STREAM_MAGIC:
+                _decrypt_stream(self.crypto, src, dst)
+            else:
+                # Backup cifrati prima del formato a blocchi: un unico token
+                src.seek(0)
+                dst.write(self.crypto.decrypt_data(src.read()))
         
         return temp_file
     
@@ -471,44 +761,111 @@ class ArchiveManager:
         """Ripristina da un backup compresso."""
         import tarfile
         
-        with tarfile.open(backup_file, 'r:*') as tar:
-            tar.extractall(self.data_dir)
+        pigz = shutil.which('pigz')
+        if pigz is None or not backup_file.name.endswith('.gz'):
+            with tarfile.open(backup_file, 'r|*') as tar:
+                self._extract_members(tar)
+            return
+        
+        # Decompressione in un processo separato, estrazione in streaming
+        proc = subprocess.Popen([pigz, '-dc', str(backup_file)], stdout=subprocess.PIPE)
+        try:
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+                self._extract_members(tar)
+        finally:
+            proc.stdout.close()
+            returncode = proc.wait()
+        if returncode != 0:
+            raise RuntimeError(f"pigz terminato con codice {returncode}")
+    
+    def _extract_members(self, tar):
+        """Estrae un tar letto in streaming con più thread di scrittura.
+        
+        Il thread chiamante legge i membri in ordine e mette i file in una coda
+        limitata; i thread di scrittura li salvano su disco in parallelo.
+        Directory, link e file grandi sono estratti direttamente dal lettore,
+        con il filtro 'data' di tarfile dove disponibile: niente link che
+        puntano fuori da data_dir né file scritti attraverso di essi. Prima di
+        un hardlink la coda viene svuotata, perché il file a cui punta deve
+        essere già su disco.
+        """
+        import tarfile
+        
+        data_dir = os.path.realpath(self.data_dir)
+        extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+        pending = queue.Queue(maxsize=_RESTORE_QUEUE_SIZE)
+        workers = min(32, os.cpu_count() or 1)
+        directories = []
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            writers = [pool.submit(_write_members, pending) for _ in range(workers)]
+            try:
+                for member in tar:
+                    if member.isfile() and member.size <= _RESTORE_INLINE_SIZE:
+                        dest_path = _member_path(data_dir, member.name)
+                        pending.put((dest_path, tar.extractfile(member).read(),
+                                     _data_file_mode(member.mode), member.mtime))
+                    elif member.isdir():
+                        dest_path = _member_path(data_dir, member.name)
+                        os.makedirs(dest_path, exist_ok=True)
+                        directories.append((dest_path, member))
+                    else:
+                        _member_path(data_dir, member.name)
+                        if member.issym():
+                            _member_path(data_dir, os.path.join(os.path.dirname(member.name), member.linkname))
+                        elif member.islnk():
+                            _member_path(data_dir, member.linkname)
+                            pending.join()
+                        tar.extract(member, data_dir, **extract_kwargs)
+            finally:
+                for _ in writers:
+                    pending.put(None)
+            
+            for writer in writers:
+                writer.result()
+        
+        # Come extractall: permessi e date delle directory dopo averle riempite
+        for dest_path, member in reversed(directories):
+            os.chmod(dest_path, member.mode & 0o755)
+            os.utime(dest_path, (member.mtime, member.mtime))
     
     def _restore_directory_backup(self, backup_dir: Path):
         """Ripristina da un backup directory."""
-        for archive_name in self.archives.keys():
-            source_path = backup_dir / archive_name
-            if source_path.exists():
-                dest_path = self.archives[archive_name]
-                if dest_path.exists():
-                    shutil.rmtree(dest_path)
-                shutil.copytree(source_path, dest_path)
+        with ThreadPoolExecutor(max_workers=len(self.archives)) as pool:
+            copies = [
+                pool.submit(_replace_tree, backup_dir / archive_name, dest_path)
+                for archive_name, dest_path in self.archives.items()
+                if (backup_dir / archive_name).exists()
+            ]
+            for copy in copies:
+                copy.result()
     
+    @_fresh_index
     def clean_archives(self, older_than_days: int = 30, archive_type: str = None, 
                       dry_run: bool = False) -> Dict[str, List[str]]:
         """Pulisce archivi obsoleti."""
         cutoff_date = datetime.now() - timedelta(days=older_than_days)
+        cutoff_ns = int(cutoff_date.timestamp() * 1e9)
         removed_files = {}
         
         archives_to_clean = [archive_type] if archive_type else list(self.archives.keys())
         
         for arch_type in archives_to_clean:
             if arch_type in self.archives:
-                archive_path = self.archives[arch_type]
-                files_to_remove = []
+                records = self._index(arch_type)
+                _, mtimes = self._index_columns(records)
                 
-                for file_path in archive_path.rglob('*'):
-                    if file_path.is_file():
-                        file_time = datetime.fromtimestamp(file_path.stat().st_mtime)
-                        if file_time < cutoff_date:
-                            files_to_remove.append(str(file_path))
-                            if not dry_run:
-                                file_path.unlink()
+                # Confronto con la soglia su tutto l'archivio in un colpo solo
+                files_to_remove = [records[i].path for i in np.flatnonzero(mtimes < cutoff_ns)]
+                if not dry_run:
+                    for file_path in files_to_remove:
+                        os.unlink(file_path)
                 
                 removed_files[arch_type] = files_to_remove
         
         return removed_files
     
+    @_fresh_index
     def export_archives(self, format_type: str = 'json', output_file: str = None, 
                        include_metadata: bool = False) -> str:
         """Esporta gli archivi nel formato specificato."""
@@ -527,22 +884,32 @@ class ArchiveManager:
             'archives': {}
         }
         
-        for arch_type, archive_path in self.archives.items():
+        json_records = {
+            arch_type: [record for record in self._index(arch_type) if record.suffix == '.json']
+            for arch_type in self.archives
+        }
+        # Il parsing JSON è CPU-bound: con molti file viene distribuito su più processi
+        loaded = iter(_map_json_files(
+            _load_json_files,
+            [record.path for records in json_records.values() for record in records]
+        ))
+        
+        for arch_type, records in json_records.items():
             archive_data = []
             
-            for file_path in archive_path.rglob('*.json'):
+            for record, (data, error) in zip(records, loaded):
                 try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        
-                        if include_metadata:
-                            file_info = self._get_file_info(file_path)
-                            data['_file_metadata'] = file_info
-                        
-                        archive_data.append(data)
+                    if error is not None:
+                        raise error
+                    
+                    if include_metadata:
+                        file_info = self._get_file_info(record)
+                        data['_file_metadata'] = file_info
+                    
+                    archive_data.append(data)
                 except Exception as e:
                     if self.verbose:
-                        print(f"Errore nel leggere {file_path}: {e}")
+                        print(f"Errore nel leggere {record.path}: {e}")
             
             export_data['archives'][arch_type] = archive_data
         
@@ -551,8 +918,8 @@ class ArchiveManager:
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
         if format_type == 'json':
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(export_data, f, indent=2, ensure_ascii=False)
+            with open(output_path, 'wb') as f:
+                f.write(_dumps_indented(export_data))
         
         elif format_type == 'yaml':
             import yaml
@@ -571,63 +938,87 @@ class ArchiveManager:
         """Esporta in formato CSV."""
         import csv
         
-        with open(output_path, 'w', newline='', encoding='utf-8') as f:
+        with open(output_path, 'w', newline='', encoding='utf-8', buffering=1 << 20) as f:
             writer = csv.writer(f)
             writer.writerow(['Archive', 'Type', 'Name', 'Created', 'Significance', 'Tags'])
             
-            for arch_type, items in data['archives'].items():
-                for item in items:
-                    metadata = item.get('metadata', {})
-                    writer.writerow([
-                        arch_type,
-                        metadata.get('type', ''),
-                        metadata.get('name', ''),
-                        metadata.get('created_at', ''),
-                        metadata.get('significance', ''),
-                        ', '.join(metadata.get('tags', []))
-                    ])
+            # Righe prodotte da un generatore e scritte in blocco dal writer C
+            writer.writerows(
+                (
+                    arch_type,
+                    metadata.get('type', ''),
+                    metadata.get('name', ''),
+                    metadata.get('created_at', ''),
+                    metadata.get('significance', ''),
+                    ', '.join(metadata.get('tags', []))
+                )
+                for arch_type, items in data['archives'].items()
+                for item in items
+                for metadata in (item.get('metadata', {}),)
+            )
     
     def _export_to_xml(self, data: Dict[str, Any], output_path: Path):
-        """Esporta in formato XML."""
-        import xml.etree.ElementTree as ET
-        
-        root = ET.Element('onepai_export')
+        """Esporta in formato XML.
         
-        # Metadati
-        metadata_elem = ET.SubElement(root, 'metadata')
-        for key, value in data['export_metadata'].items():
-            elem = ET.SubElement(metadata_elem, key)
-            elem.text = str(value)
+        Gli elementi sono scritti man mano con XMLGenerator, senza costruire
+        l'albero in memoria.
+        """
+        from xml.sax.saxutils import XMLGenerator
         
-        # Archivi
-        archives_elem = ET.SubElement(root, 'archives')
-        for arch_type, items in data['archives'].items():
-            archive_elem = ET.SubElement(archives_elem, 'archive', type=arch_type)
+        with open(output_path, 'wb', buffering=1 << 20) as f:
+            gen = XMLGenerator(f, encoding='utf-8', short_empty_elements=True)
+            gen.startDocument()
+            gen.startElement('onepai_export', {})
             
-            for item in items:
-                item_elem = ET.SubElement(archive_elem, 'item')
-                self._dict_to_xml(item, item_elem)
-        
-        tree = ET.ElementTree(root)
-        tree.write(output_path, encoding='utf-8', xml_declaration=True)
+            # Metadati
+            gen.startElement('metadata', {})
+            for key, value in data['export_metadata'].items():
+                self._write_xml_text(gen, key, value)
+            gen.endElement('metadata')
+            
+            # Archivi
+            gen.startElement('archives', {})
+            for arch_type, items in data['archives'].items():
+                gen.startElement('archive', {'type': arch_type})
+                
+                for item in items:
+                    gen.startElement('item', {})
+                    self._dict_to_xml(item, gen)
+                    gen.endElement('item')
+                
+                gen.endElement('archive')
+            gen.endElement('archives')
+            
+            gen.endElement('onepai_export')
+            gen.endDocument()
     
-    def _dict_to_xml(self, data: Dict[str, Any], parent: ET.Element):
-        """Converte un dizionario in XML."""
+    def _dict_to_xml(self, data: Dict[str, Any], gen):
+        """Scrive un dizionario come elementi XML sul generatore."""
         for key, value in data.items():
-            elem = ET.SubElement(parent, key)
-            
             if isinstance(value, dict):
-                self._dict_to_xml(value, elem)
+                gen.startElement(key, {})
+                self._dict_to_xml(value, gen)
+                gen.endElement(key)
             elif isinstance(value, list):
+                gen.startElement(key, {})
                 for item in value:
-                    item_elem = ET.SubElement(elem, 'item')
                     if isinstance(item, dict):
-                        self._dict_to_xml(item, item_elem)
+                        gen.startElement('item', {})
+                        self._dict_to_xml(item, gen)
+                        gen.endElement('item')
                     else:
-                        item_elem.text = str(item)
+                        self._write_xml_text(gen, 'item', item)
+                gen.endElement(key)
             else:
-                elem.text = str(value)
+                self._write_xml_text(gen, key, value)
     
+    def _write_xml_text(self, gen, name: str, value: Any):
+        """Scrive un elemento con il solo contenuto testuale."""
+        gen.startElement(name, {})
+        gen.characters(str(value))
+        gen.endElement(name)
+    
+    @_fresh_index
     def verify_archives(self, fix: bool = False) -> Dict[str, Any]:
         """Verifica l'integrità degli archivi."""
         results = {
@@ -638,53 +1029,78 @@ class ArchiveManager:
             'fixed_issues': []
         }
         
-        for arch_type, archive_path in self.archives.items():
-            if not archive_path.exists():
-                continue
+        records_by_archive = {arch_type: self._index(arch_type) for arch_type in self.archives}
+        
+        # Validazione dei JSON di tutti gli archivi in un solo passaggio (parallelo se sono molti)
+        json_paths = [
+            record.path
+            for records in records_by_archive.values()
+            for record in records
+            if record.suffix == '.json'
+        ]
+        json_status = dict(zip(json_paths, _map_json_files(_check_json_files, json_paths)))
+        
+        # Controlli per estensione; gli altri file vengono solo contati
+        handlers = {'.json': self._verify_json, '.key': self._verify_key}
+        
+        for arch_type, records in records_by_archive.items():
+            # Percorsi dell'archivio, per cercare i file cifrati senza stat
+            indexed_paths = {record.path for record in records}
             
-            for file_path in archive_path.rglob('*'):
-                if file_path.is_file():
-                    results['total_files'] += 1
-                    
-                    # Verifica file JSON
-                    if file_path.suffix == '.json':
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as f:
-                                data = json.load(f)
-                                
-                                # Verifica presenza metadati
-                                if 'metadata' not in data:
-                                    results['missing_metadata'].append(str(file_path))
-                                    
-                                    if fix:
-                                        # Aggiungi metadati di base
-                                        data['metadata'] = {
-                                            'id': file_path.stem,
-                                            'created_at': datetime.fromtimestamp(file_path.stat().st_ctime).isoformat(),
-                                            'type': 'unknown',
-                                            'version': '1.0'
-                                        }
-                                        
-                                        with open(file_path, 'w', encoding='utf-8') as f:
-                                            json.dump(data, f, indent=2, ensure_ascii=False)
-                                        
-                                        results['fixed_issues'].append(f"Added metadata to {file_path}")
-                        
-                        except json.JSONDecodeError:
-                            results['corrupted_files'].append(str(file_path))
-                    
-                    # Verifica file di chiavi orfani
-                    elif file_path.suffix == '.key':
-                        corresponding_file = file_path.with_suffix('.encrypted')
-                        if not corresponding_file.exists():
-                            results['orphaned_keys'].append(str(file_path))
-                            
-                            if fix:
-                                file_path.unlink()
-                                results['fixed_issues'].append(f"Removed orphaned key {file_path}")
+            for record in records:
+                results['total_files'] += 1
+                
+                handler = handlers.get(record.suffix)
+                if handler is not None:
+                    context = json_status if record.suffix == '.json' else indexed_paths
+                    handler(record, context, fix, results)
         
         return results
     
+    def _verify_json(self, record: FileRecord, json_status: Dict[str, Tuple[str, Optional[Exception]]],
+                     fix: bool, results: Dict[str, Any]):
+        """Verifica un file JSON già validato, aggiungendo i metadati mancanti con fix."""
+        status, error = json_status[record.path]
+        if error is not None:
+            raise error
+        
+        if status == 'corrupted':
+            results['corrupted_files'].append(record.path)
+            return
+        
+        # Verifica presenza metadati
+        if status == 'ok':
+            return
+        results['missing_metadata'].append(record.path)
+        
+        if not fix or status != 'missing':
+            return
+        
+        # Aggiungi metadati di base
+        metadata = {
+            'id': Path(record.path).stem,
+            'created_at': datetime.fromtimestamp(record.ctime_ns / 1e9).isoformat(),
+            'type': 'unknown',
+            'version': '1.0'
+        }
+        _append_json_member(record.path, 'metadata', metadata)
+        results['fixed_issues'].append(f"Added metadata to {record.path}")
+    
+    def _verify_key(self, record: FileRecord, indexed_paths: set,
+                    fix: bool, results: Dict[str, Any]):
+        """Verifica che una chiave abbia il suo file cifrato, rimuovendola con fix."""
+        corresponding_file = record.path[:-len(record.suffix)] + '.encrypted'
+        if corresponding_file in indexed_paths:
+            return
+        
+        results['orphaned_keys'].append(record.path)
+        if not fix:
+            return
+        
+        os.unlink(record.path)
+        results['fixed_issues'].append(f"Removed orphaned key {record.path}")
+    
+    @_fresh_index
     def get_statistics(self, detailed: bool = False) -> Dict[str, Any]:
         """Ottiene statistiche sugli archivi."""
         stats = {
@@ -698,56 +1114,37 @@ class ArchiveManager:
             'by_archive': {}
         }
         
-        oldest_time = None
-        newest_time = None
+        oldest = None
+        newest = None
         
-        for arch_type, archive_path in self.archives.items():
+        for arch_type in self.archives:
+            summary = self._archive_summary(arch_type)
             archive_stats = {
-                'file_count': 0,
-                'total_size': 0,
-                'file_types': {},
-                'avg_file_size': 0
+                'file_count': summary['file_count'],
+                'total_size': summary['total_size'],
+                'file_types': dict(summary['file_types']),
+                'avg_file_size': summary['avg_file_size']
             }
             
-            if detailed:
-                archive_stats['files'] = []
+            # Traccia file più vecchio e più nuovo
+            if summary['oldest'] is not None and (oldest is None or summary['oldest'][0] < oldest[0]):
+                oldest = summary['oldest']
+                stats['summary']['oldest_file'] = oldest[1]
             
-            if archive_path.exists():
-                file_sizes = []
-                
-                for file_path in archive_path.rglob('*'):
-                    if file_path.is_file():
-                        file_stat = file_path.stat()
-                        file_size = file_stat.st_size
-                        file_time = datetime.fromtimestamp(file_stat.st_mtime)
-                        
-                        archive_stats['file_count'] += 1
-                        archive_stats['total_size'] += file_size
-                        file_sizes.append(file_size)
-                        
-                        # Traccia tipo di file
-                        file_type = self._determine_file_type(file_path)
-                        archive_stats['file_types'][file_type] = archive_stats['file_types'].get(file_type, 0) + 1
-                        
-                        # Traccia file più vecchio e più nuovo
-                        if oldest_time is None or file_time < oldest_time:
-                            oldest_time = file_time
-                            stats['summary']['oldest_file'] = str(file_path)
-                        
-                        if newest_time is None or file_time > newest_time:
-                            newest_time = file_time
-                            stats['summary']['newest_file'] = str(file_path)
-                        
-                        if detailed:
-                            archive_stats['files'].append({
-                                'name': file_path.name,
-                                'size': file_size,
-                                'type': file_type,
-                                'modified': file_time.isoformat()
-                            })
-                
-                if file_sizes:
-                    archive_stats['avg_file_size'] = sum(file_sizes) / len(file_sizes)
+            if summary['newest'] is not None and (newest is None or summary['newest'][0] > newest[0]):
+                newest = summary['newest']
+                stats['summary']['newest_file'] = newest[1]
+            
+            if detailed:
+                archive_stats['files'] = [
+                    {
+                        'name': record.name,
+                        'size': record.size,
+                        'type': self._determine_file_type(record.suffix),
+                        'modified': datetime.fromtimestamp(record.mtime_ns / 1e9).isoformat()
+                    }
+                    for record in self._index(arch_type)
+                ]
             
             stats['by_archive'][arch_type] = archive_stats
             stats['summary']['total_files'] += archive_stats['file_count']
@@ -756,10 +1153,390 @@ class ArchiveManager:
         return stats
 
 
+def _dumps_indented(data: Any, default=None) -> bytes:
+    """JSON indentato di due spazi in UTF-8, con orjson quando disponibile.
+    
+    Ricade su json per ciò che orjson rifiuta (ad esempio interi oltre 64 bit).
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(
+                data, default=default,
+                option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+            )
+        except orjson.JSONEncodeError:
+            pass
+    return json.dumps(data, indent=2, ensure_ascii=False, default=default).encode('utf-8')
+
+
+class _EncryptingWriter:
+    """File di sola scrittura che cifra i dati in blocchi di dimensione fissa.
+    
+    Ogni blocco in chiaro è preceduto da numero di sequenza e flag di ultimo
+    blocco, così riordini e troncamenti vengono rilevati in decifratura; sul
+    file finisce la lunghezza del token seguita dal token stesso.
+    """
+    
+    def __init__(self, crypto, dst):
+        self.crypto = crypto
+        self.dst = dst
+        self._buffer = bytearray()
+        self._sequence = 0
+        dst.write(_STREAM_MAGIC)
+    
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= _STREAM_CHUNK_SIZE:
+            self._emit(bytes(self._buffer[:_STREAM_CHUNK_SIZE]), last=False)
+            del self._buffer[:_STREAM_CHUNK_SIZE]
+        return len(data)
+    
+    def close(self):
+        """Cifra il blocco residuo come ultimo blocco."""
+        self._emit(bytes(self._buffer), last=True)
+        self._buffer.clear()
+    
+    def _emit(self, chunk: bytes, last: bool):
+        token = self.crypto.encrypt_data(struct.pack('>QB', self._sequence, last) + chunk)
+        self.dst.write(struct.pack('>I', len(token)))
+        self.dst.write(token)
+        self._sequence += 1
+
+
+def _decrypt_stream(crypto, src, dst):
+    """Decifra i blocchi scritti da _EncryptingWriter, dopo l'intestazione."""
+    expected = 0
+    while True:
+        header = src.read(4)
+        if len(header) < 4:
+            raise ValueError("Backup cifrato troncato")
+        
+        (length,) = struct.unpack('>I', header)
+        plain = crypto.decrypt_data(src.read(length))
+        sequence, last = struct.unpack_from('>QB', plain)
+        if sequence != expected:
+            raise ValueError("Backup cifrato corrotto: blocchi fuori sequenza")
+        
+        dst.write(memoryview(plain)[9:])
+        if last:
+            return
+        expected += 1
+
+
+def _file_digest(path: str) -> str:
+    """Hash del contenuto di un file, con il nome dell'algoritmo come prefisso."""
+    hasher = blake3() if blake3 is not None else hashlib.blake2b()
+    with open(path, 'rb') as f:
+        # Il file mappato va all'hash senza copie in oggetti bytes
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                hasher.update(mm)
+    return f"{'blake3' if blake3 is not None else 'blake2b'}:{hasher.hexdigest()}"
+
+
+def _link_previous(source_path: Path, dest_path: Path) -> bool:
+    """Crea un hardlink alla copia del backup precedente; False se non è possibile."""
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        # Backup precedente rimosso, filesystem diversi o hardlink non supportati
+        return False
+    return True
+
+
+def _load_manifest(manifest_path: Path) -> Dict[str, List]:
+    """Manifest dei backup: percorso relativo -> [dimensione, mtime_ns, hash, backup]."""
+    try:
+        with open(manifest_path, 'rb') as f:
+            manifest = _json_loads(f.read())
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def _save_manifest(manifest_path: Path, entries: Dict[str, List]):
+    """Salva il manifest in modo atomico."""
+    tmp_path = manifest_path.with_name(f"{manifest_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(_dumps_indented(entries))
+    os.replace(tmp_path, manifest_path)
+
+
+def _replace_tree(source_path: Path, dest_path: Path):
+    """Sostituisce dest_path con una copia di source_path."""
+    if dest_path.exists():
+        shutil.rmtree(dest_path)
+    shutil.copytree(source_path, dest_path, copy_function=_fast_copy)
+
+
+def _fast_copy(source_path, dest_path):
+    """Copia un file con i metadati restando nel kernel quando possibile.
+    
+    Prova copy_file_range (reflink sui filesystem copy-on-write), poi
+    sendfile e infine la copia a blocchi di shutil.
+    """
+    with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+        remaining = os.fstat(src_fd).st_size
+        copied = 0
+        
+        for kernel_copy in _KERNEL_COPIES:
+            try:
+                while remaining > 0:
+                    sent = kernel_copy(src_fd, dst_fd, copied, min(remaining, 1 << 30))
+                    if sent == 0:
+                        break
+                    copied += sent
+                    remaining -= sent
+                break
+            except OSError:
+                # Syscall non supportata tra questi filesystem: si passa alla successiva
+                continue
+        
+        if remaining > 0:
+            # Nessuna syscall disponibile o file cambiato durante la copia
+            src.seek(copied)
+            dst.seek(copied)
+            shutil.copyfileobj(src, dst, _STREAM_CHUNK_SIZE)
+    
+    shutil.copystat(source_path, dest_path)
+    return dest_path
+
+
+def _copy_file_range_at(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+
+def _sendfile_at(src_fd: int, dst_fd: int, offset: int, count: int) -> int:
+    os.lseek(dst_fd, offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+# Copie nel kernel disponibili su questa piattaforma, in ordine di preferenza
+_KERNEL_COPIES = tuple(
+    copy for name, copy in (('copy_file_range', _copy_file_range_at), ('sendfile', _sendfile_at))
+    if hasattr(os, name)
+)
+
+
+def _member_path(data_dir: str, name: str) -> str:
+    """Percorso di destinazione di un membro del tar, che deve restare in data_dir.
+    
+    data_dir deve essere già risolto con realpath: il controllo segue i link
+    simbolici estratti in precedenza, così un membro non può essere scritto
+    fuori da data_dir passando per un link.
+    """
+    dest_path = os.path.normpath(os.path.join(data_dir, name))
+    if os.path.commonpath([data_dir, os.path.realpath(dest_path)]) != data_dir:
+        raise ValueError(f"Percorso non valido nel backup: {name}")
+    return dest_path
+
+
+def _data_file_mode(mode: int) -> int:
+    """Permessi di un file estratto, ridotti come fa tarfile.data_filter.
+    
+    Niente setuid/setgid/sticky né scrittura per gruppo e altri; il
+    proprietario può sempre leggere e scrivere, e l'esecuzione resta solo
+    se è concessa al proprietario.
+    """
+    mode &= 0o755
+    if not mode & 0o100:
+        mode &= ~0o111
+    return mode | 0o600
+
+
+def _write_members(pending: queue.Queue):
+    """Scrive i file messi in coda da _extract_members fino al segnale di fine.
+    
+    Ogni voce viene segnata con task_done, così il lettore può attendere con
+    pending.join() che i file già letti siano su disco.
+    """
+    error = None
+    while True:
+        item = pending.get()
+        if item is None:
+            pending.task_done()
+            break
+        try:
+            if error is not None:
+                # Si continua a svuotare la coda per non bloccare il lettore
+                continue
+            
+            dest_path, data, mode, mtime = item
+            try:
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                with open(dest_path, 'wb') as f:
+                    f.write(data)
+                os.chmod(dest_path, mode)
+                os.utime(dest_path, (mtime, mtime))
+            except OSError as e:
+                error = e
+        finally:
+            pending.task_done()
+    
+    if error is not None:
+        raise error
+
+
+def _map_json_files(func: Callable[[List[str]], List], paths: List[str]) -> List:
+    """Applica func (lista di percorsi -> lista di risultati) a tutti i percorsi.
+    
+    Sopra _PARALLEL_JSON_MIN_FILES i percorsi sono divisi in blocchi
+    elaborati da un pool di processi; l'ordine dei risultati è preservato.
+    """
+    if len(paths) < _PARALLEL_JSON_MIN_FILES:
+        return func(paths)
+    
+    workers = os.cpu_count() or 1
+    step = -(-len(paths) // workers)
+    chunks = [paths[i:i + step] for i in range(0, len(paths), step)]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        return [result for chunk in pool.map(func, chunks) for result in chunk]
+
+
+def _check_json_files(paths: List[str]) -> List[Tuple[str, Optional[Exception]]]:
+    """Valida file JSON: per ognuno ('ok' | 'missing' | 'missing_not_object' | 'corrupted', None).
+    
+    Errori diversi dal parsing (lettura, codifica) sono restituiti come
+    secondo elemento e rilanciati da chi verifica.
+    """
+    checked = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if 'metadata' in data:
+                checked.append(('ok', None))
+            else:
+                checked.append(('missing' if isinstance(data, dict) else 'missing_not_object', None))
+        except json.JSONDecodeError:
+            checked.append(('corrupted', None))
+        except Exception as e:
+            checked.append(('error', e))
+    return checked
+
+
+def _append_json_member(path: str, key: str, value: Any):
+    """Aggiunge una chiave in coda all'oggetto JSON radice di un file valido.
+    
+    Si riscrive solo la parte finale del file, dalla parentesi di chiusura:
+    il resto del documento resta intatto.
+    """
+    with open(path, 'r+b') as f:
+        size = f.seek(0, os.SEEK_END)
+        tail_size = min(size, 4096)
+        f.seek(size - tail_size)
+        tail = f.read(tail_size)
+        if b'}' not in tail:
+            # Coda di soli spazi più lunga del blocco: si legge tutto il file
+            f.seek(0)
+            tail_size = size
+            tail = f.read()
+        close = tail.rindex(b'}')
+        
+        # La '{' subito prima della chiusura finale può essere solo quella radice: oggetto vuoto
+        head = tail[:close].rstrip()
+        empty = head.endswith(b'{')
+        
+        member = (b'' if empty else b',') + json.dumps(
+            {key: value}, indent=2, ensure_ascii=False
+        )[1:-2].encode('utf-8') + b'\n'
+        f.seek(size - tail_size + len(head))
+        f.write(member + tail[close:])
+        # Gli spazi sostituiti possono essere più lunghi del nuovo membro
+        f.truncate()
+
+
+def _load_json_files(paths: List[str]) -> List[Tuple[Any, Optional[Exception]]]:
+    """Legge una lista di file JSON; per ognuno restituisce (dati, None) o (None, errore).
+    
+    Funzione di modulo perché eseguita anche nei processi worker dell'export.
+    """
+    loaded = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                loaded.append((json.load(f), None))
+        except Exception as e:
+            loaded.append((None, e))
+    return loaded
+
+
+def _record_metadata(record: FileRecord) -> Dict[str, Any]:
+    """Metadati di una voce dell'indice; vuoto se non è un tesoro JSON o non ne ha."""
+    if record.suffix != '.json':
+        return {}
+    return _read_metadata(record.path, record.mtime_ns) or {}
+
+
+@lru_cache(maxsize=4096)
+def _read_metadata(path: str, mtime_ns: int) -> Optional[Dict[str, Any]]:
+    """Legge solo l'oggetto `metadata` di un tesoro JSON, None se assente o illeggibile.
+    
+    Con ijson il file viene letto in streaming e si materializza solo il
+    sottoalbero dei metadati; la cache è indicizzata anche su mtime_ns,
+    quindi un file modificato viene riletto. Il risultato è condiviso e
+    non va modificato.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if ijson is not None:
+                metadata = next(ijson.items(f, 'metadata', use_float=True), None)
+            else:
+                raw = f.read()
+                if b'"metadata"' not in raw:
+                    return None
+                metadata = _peek_metadata(raw)
+                if metadata is None:
+                    data = _json_loads(raw)
+                    metadata = data.get('metadata') if isinstance(data, dict) else None
+    except Exception:
+        return None  # Ignora errori di parsing
+    
+    return metadata if isinstance(metadata, dict) else None
+
+
+def _peek_metadata(raw: bytes) -> Optional[Dict[str, Any]]:
+    """Estrae l'oggetto `metadata` di primo livello senza analizzare il resto.
+    
+    Vale solo per il caso comune: una sola chiave `metadata`, primo o ultimo
+    membro del documento, con un oggetto senza oggetti annidati. In questi
+    casi basta guardare cosa c'è prima o dopo la chiave per sapere che
+    appartiene all'oggetto radice. Negli altri casi restituisce None e il
+    chiamante analizza l'intero file. Il resto del documento non viene
+    validato: i file corrotti li segnala verify.
+    """
+    pos = raw.find(b'"metadata"')
+    if pos < 0 or raw.find(b'"metadata"', pos + 1) >= 0:
+        return None
+    
+    match = _METADATA_RE.match(raw, pos)
+    if match is None:
+        return None
+    
+    tail = len(raw) - match.end()
+    if pos <= 64 and raw[:pos].strip(_JSON_WHITESPACE) == b'{':
+        # Primo membro: il documento deve anche chiudersi
+        top_level = raw.rstrip(_JSON_WHITESPACE).endswith(b'}')
+    elif tail <= 64 and raw[match.end():].strip(_JSON_WHITESPACE) == b'}':
+        # Ultimo membro: chiuso dalla graffa finale, quindi dalla radice
+        top_level = raw.lstrip(_JSON_WHITESPACE).startswith(b'{')
+    else:
+        top_level = False
+    if not top_level:
+        return None
+    
+    try:
+        return _json_loads(match.group(1))
+    except ValueError:
+        return None
+
+
 def format_output(data: Any, format_type: str):
     """Formatta l'output nel formato richiesto."""
     if format_type == 'json':
-        print(json.dumps(data, indent=2, ensure_ascii=False, default=str))
+        print(_dumps_indented(data, default=str).decode('utf-8'))
     
     elif format_type == 'table':
         if isinstance(data, dict):
@@ -799,7 +1576,7 @@ def main():
         manager = ArchiveManager(args.data_dir, args.verbose)
         
         if args.command == 'list':
-            results = manager.list_archives(args.archive_type, args.format, args.filter_by)
+            results = manager.list_archives(args.archive_type, args.format, args.filter_by, args.limit)
             format_output(results, args.format)
         
         elif args.command == 'backup':
@@ -837,44 +1614,52 @@ def main():
         elif args.command == 'verify':
             results = manager.verify_archives(args.fix)
             
-            print(f"File totali verificati: {results['total_files']}")
-            print(f"File corrotti: {len(results['corrupted_files'])}")
-            print(f"File senza metadati: {len(results['missing_metadata'])}")
-            print(f"Chiavi orfane: {len(results['orphaned_keys'])}")
+            # Righe raccolte e scritte con un'unica write
+            lines = [
+                f"File totali verificati: {results['total_files']}",
+                f"File corrotti: {len(results['corrupted_files'])}",
+                f"File senza metadati: {len(results['missing_metadata'])}",
+                f"Chiavi orfane: {len(results['orphaned_keys'])}"
+            ]
             
             if args.fix:
-                print(f"Problemi risolti: {len(results['fixed_issues'])}")
-                if args.verbose and results['fixed_issues']:
-                    for fix in results['fixed_issues']:
-                        print(f"  - {fix}")
+                lines.append(f"Problemi risolti: {len(results['fixed_issues'])}")
+                if args.verbose:
+                    lines.extend(f"  - {fix}" for fix in results['fixed_issues'])
+            
+            sys.stdout.write('\n'.join(lines) + '\n')
         
         elif args.command == 'stats':
             stats = manager.get_statistics(args.detailed)
             
             summary = stats['summary']
-            print(f"Statistiche Archivi ONEPAI")
-            print(f"=" * 30)
-            print(f"Archivi totali: {summary['total_archives']}")
-            print(f"File totali: {summary['total_files']}")
-            print(f"Dimensione totale: {summary['total_size_bytes']:,} bytes")
+            # Righe raccolte e scritte con un'unica write
+            lines = [
+                "Statistiche Archivi ONEPAI",
+                "=" * 30,
+                f"Archivi totali: {summary['total_archives']}",
+                f"File totali: {summary['total_files']}",
+                f"Dimensione totale: {summary['total_size_bytes']:,} bytes"
+            ]
             
             if summary['oldest_file']:
-                print(f"File più vecchio: {summary['oldest_file']}")
+                lines.append(f"File più vecchio: {summary['oldest_file']}")
             if summary['newest_file']:
-                print(f"File più recente: {summary['newest_file']}")
+                lines.append(f"File più recente: {summary['newest_file']}")
             
-            print("\nPer archivio:")
+            lines.append("\nPer archivio:")
             for arch_type, arch_stats in stats['by_archive'].items():
-                print(f"  {arch_type}:")
-                print(f"    File: {arch_stats['file_count']}")
-                print(f"    Dimensione: {arch_stats['total_size']:,} bytes")
+                lines.append(f"  {arch_type}:")
+                lines.append(f"    File: {arch_stats['file_count']}")
+                lines.append(f"    Dimensione: {arch_stats['total_size']:,} bytes")
                 if arch_stats['file_count'] > 0:
-                    print(f"    Dimensione media: {arch_stats['avg_file_size']:.0f} bytes")
+                    lines.append(f"    Dimensione media: {arch_stats['avg_file_size']:.0f} bytes")
                 
                 if args.detailed and arch_stats['file_types']:
-                    print(f"    Tipi di file:")
-                    for file_type, count in arch_stats['file_types'].items():
-                        print(f"      {file_type}: {count}")
+                    lines.append("    Tipi di file:")
+                    lines.extend(f"      {file_type}: {count}" for file_type, count in arch_stats['file_types'].items())
+            
+            sys.stdout.write('\n'.join(lines) + '\n')
         
         return 0
         
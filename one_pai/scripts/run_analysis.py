@@ -1,24 +1,21 @@
 #!/usr/bin/env python3
 """
 Script per eseguire analisi sul sistema ONEPAI
-Utilizzo: python run_analysis.py --analysis <tipo> [--options]
+Utilizzo: python run_analysis.py --analysis <tipo> [<tipo> ...] [--options]
 """
 
 import argparse
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Iterator, Optional, Tuple
 
 # Aggiungi la directory src al path per importare il pacchetto onepai
 sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
 
-from onepai.core.observer import ONEPAI_Observer
-from onepai.core.archive import TreasureArchive
-from onepai.reader.query import ShadowQueryEngine
-from onepai.analysis.absence_patterns import AbsencePatternAnalyzer
-from onepai.analysis.silence_metrics import SilenceMetricsCalculator
-from onepai.analysis.void_statistics import VoidStatisticsCalculator
+# I moduli di analisi sono importati dalle rispettive funzioni run_*:
+# un'esecuzione carica solo i sottosistemi che usa
 from onepai.utils.config import load_config
 from onepai.utils.logger import setup_logger
 
@@ -34,9 +31,10 @@ def setup_argument_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--analysis",
         type=str,
+        nargs="+",
         required=True,
         choices=["shadow", "silence", "void", "absence", "treasure"],
-        help="Tipo di analisi da eseguire"
+        help="Tipi di analisi da eseguire (più analisi vengono eseguite in parallelo)"
     )
     
     parser.add_argument(
@@ -108,6 +106,9 @@ def run_shadow_analysis(args: argparse.Namespace, config: Dict[str, Any]) -> Dic
     """Esegue l'analisi delle ombre neurali"""
     logger.info("Avvio analisi shadow...")
     
+    from onepai.core.observer import ONEPAI_Observer
+    from onepai.reader.query import ShadowQueryEngine
+    
     # Inizializza i componenti necessari
     observer = ONEPAI_Observer(target_ai=None)  # Sarà configurato tramite config
     query_engine = ShadowQueryEngine(config.get("shadow_query", {}))
@@ -130,6 +131,8 @@ def run_silence_analysis(args: argparse.Namespace, config: Dict[str, Any]) -> Di
     """Esegue l'analisi dei silenzi cognitivi"""
     logger.info("Avvio analisi silence...")
     
+    from onepai.analysis.silence_metrics import SilenceMetricsCalculator
+    
     # Inizializza i componenti necessari
     metrics_calc = SilenceMetricsCalculator(
         window_size=args.silence_window,
@@ -152,6 +155,8 @@ def run_void_analysis(args: argparse.Namespace, config: Dict[str, Any]) -> Dict[
     """Esegue l'analisi del vuoto cognitivo"""
     logger.info("Avvio analisi void...")
     
+    from onepai.analysis.void_statistics import VoidStatisticsCalculator
+    
     # Inizializza i componenti necessari
     void_calc = VoidStatisticsCalculator(
         depth=args.void_depth,
@@ -174,6 +179,8 @@ def run_absence_analysis(args: argparse.Namespace, config: Dict[str, Any]) -> Di
     """Esegue l'analisi dei pattern di assenza"""
     logger.info("Avvio analisi absence...")
     
+    from onepai.analysis.absence_patterns import AbsencePatternAnalyzer
+    
     # Inizializza i componenti necessari
     pattern_analyzer = AbsencePatternAnalyzer(
         min_frequency=args.absence_min_frequency,
@@ -196,6 +203,8 @@ def run_treasure_analysis(args: argparse.Namespace, config: Dict[str, Any]) -> D
     """Esegue l'analisi degli archivi treasure"""
     logger.info("Avvio analisi treasure...")
     
+    from onepai.core.archive import TreasureArchive
+    
     # Inizializza i componenti necessari
     archive = TreasureArchive(
         base_path=args.treasure_path,
@@ -215,12 +224,36 @@ def run_treasure_analysis(args: argparse.Namespace, config: Dict[str, Any]) -> D
     return treasure_results
 
 
-def save_results(results: Dict[str, Any], args: argparse.Namespace):
+# Funzione di analisi per ogni tipo accettato da --analysis
+ANALYSES = {
+    "shadow": run_shadow_analysis,
+    "silence": run_silence_analysis,
+    "void": run_void_analysis,
+    "absence": run_absence_analysis,
+    "treasure": run_treasure_analysis,
+}
+
+
+def flatten_results(results: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    """Appiattisce i dizionari annidati in coppie (chiave.puntata, valore), come json_normalize"""
+    stack = [("", iter(results.items()))]
+    while stack:
+        prefix, items = stack[-1]
+        for key, value in items:
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                stack.append((f"{name}.", iter(value.items())))
+                break
+            yield name, value
+        else:
+            stack.pop()
+
+
+def save_results(results: Dict[str, Any], args: argparse.Namespace, analysis_type: str):
     """Salva i risultati dell'analisi"""
     output_dir = Path(args.output)
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    analysis_type = args.analysis
     output_file = output_dir / f"{analysis_type}_analysis.{args.treasure_format}"
     
     logger.info(f"Salvataggio risultati in: {output_file}")
@@ -231,15 +264,19 @@ def save_results(results: Dict[str, Any], args: argparse.Namespace):
             json.dump(results, f, indent=2, default=str)
     
     elif args.treasure_format == "csv":
-        import pandas as pd
-        # Converti i risultati in un formato tabellare
-        df = pd.json_normalize(results)
-        df.to_csv(output_file, index=False)
+        import csv
+        # Converti i risultati in un formato tabellare: una riga, una colonna per campo
+        columns = dict(flatten_results(results))
+        with open(output_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns.keys())
+            writer.writerow(columns.values())
     
     elif args.treasure_format == "parquet":
-        import pandas as pd
-        df = pd.json_normalize(results)
-        df.to_parquet(output_file, index=False)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pydict({key: [value] for key, value in flatten_results(results)})
+        pq.write_table(table, output_file)
     
     logger.info("Risultati salvati con successo")
 
@@ -260,27 +297,23 @@ def main():
     # Configura il logger
     logger = setup_logger(config.get("logging", {}))
     
-    logger.info(f"Avvio analisi ONEPAI: {args.analysis}")
+    selected = list(dict.fromkeys(args.analysis))
+    logger.info(f"Avvio analisi ONEPAI: {', '.join(selected)}")
     logger.info(f"Configurazione caricata da: {args.config}")
     
     try:
-        # Esegui l'analisi specificata
-        if args.analysis == "shadow":
-            results = run_shadow_analysis(args, config)
-        elif args.analysis == "silence":
-            results = run_silence_analysis(args, config)
-        elif args.analysis == "void":
-            results = run_void_analysis(args, config)
-        elif args.analysis == "absence":
-            results = run_absence_analysis(args, config)
-        elif args.analysis == "treasure":
-            results = run_treasure_analysis(args, config)
+        # Esegui le analisi specificate: lavorano su oggetti indipendenti,
+        # quindi più analisi possono procedere in parallelo
+        if len(selected) == 1:
+            all_results = {selected[0]: ANALYSES[selected[0]](args, config)}
         else:
-            logger.error(f"Tipo di analisi non supportato: {args.analysis}")
-            sys.exit(1)
+            with ThreadPoolExecutor(max_workers=min(len(selected), os.cpu_count() or 1)) as pool:
+                futures = {name: pool.submit(ANALYSES[name], args, config) for name in selected}
+                all_results = {name: future.result() for name, future in futures.items()}
         
         # Salva i risultati
-        save_results(results, args)
+        for analysis_type, results in all_results.items():
+            save_results(results, args, analysis_type)
         
         logger.info("Analisi completata con successo")
     
@@ -14,24 +14,149 @@ Server locale per la visualizzazione di grafi del circuit tracer.
 
 from __future__ import annotations
 
+import gzip
+import io
 import json
+import os
 import re
+import shutil
 import threading
 import time
 import webbrowser
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from http.server import SimpleHTTPRequestHandler, HTTPServer
 from pathlib import Path
-from socketserver import ThreadingMixIn
 from typing import Optional
-from urllib.parse import urlparse
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Pattern sicuro per i nomi dei grafi (evita traversal)
 SAFE_NAME = re.compile(r"^[A-Za-z0-9._-]+$")
 
+# Risposta di /api/graphs già serializzata: valida finché non cambia l'mtime
+# della cartella e per al più _LIST_CACHE_TTL secondi (un file riscritto sul
+# posto non cambia l'mtime della cartella)
+_LIST_CACHE = {"dir": None, "mtime": -1, "payload": b"", "payload_gz": None, "ts": 0.0}
+_LIST_CACHE_LOCK = threading.Lock()
+_LIST_CACHE_TTL = 1.0
+
+# Sotto questa dimensione le risposte non vengono compresse
+_GZIP_MIN_SIZE = 1024
+
+# Grafi già compressi, in memoria: percorso -> ((size, mtime_ns, inode), dati).
+# Le voci usate meno di recente escono oltre _GZIP_CACHE_MAX_BYTES
+_GZIP_CACHE: "OrderedDict[str, tuple]" = OrderedDict()
+_GZIP_CACHE_LOCK = threading.Lock()
+_GZIP_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_gzip_cache_size = 0
 
-class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+
+def _gzip_file(src, path: Path, st: os.stat_result) -> bytes:
+    """Contenuto di src compresso con gzip, riusato finché il file non cambia.
+
+    src è il file già aperto in path e st la sua fstat: la chiave
+    (size, mtime_ns, inode) riconosce anche un file sostituito con os.replace.
+    Nella cartella dei grafi non viene scritto nulla.
+    """
+    global _gzip_cache_size
+
+    key = str(path)
+    version = (st.st_size, st.st_mtime_ns, st.st_ino)
+    with _GZIP_CACHE_LOCK:
+        cached = _GZIP_CACHE.get(key)
+        if cached is not None and cached[0] == version:
+            _GZIP_CACHE.move_to_end(key)
+            return cached[1]
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=1, mtime=0) as dst:
+        shutil.copyfileobj(src, dst, 64 * 1024)
+    data = buf.getvalue()
+
+    if len(data) <= _GZIP_CACHE_MAX_BYTES:
+        with _GZIP_CACHE_LOCK:
+            old = _GZIP_CACHE.pop(key, None)
+            if old is not None:
+                _gzip_cache_size -= len(old[1])
+            _GZIP_CACHE[key] = (version, data)
+            _gzip_cache_size += len(data)
+            while _gzip_cache_size > _GZIP_CACHE_MAX_BYTES:
+                _, (_, evicted) = _GZIP_CACHE.popitem(last=False)
+                _gzip_cache_size -= len(evicted)
+    return data
+
+
+def _dumps(obj) -> bytes:
+    """Serializza in JSON UTF-8, con orjson se disponibile."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson.JSONEncodeError (es. interi oltre 64 bit): serializzatore standard
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+class ThreadingHTTPServer(HTTPServer):
+    """HTTPServer che gestisce le richieste con un pool di thread limitato.
+
+    A differenza di ThreadingMixIn non crea un thread per connessione: i
+    thread del pool vengono riusati e il loro numero resta al più max_workers.
+    Al più max_pending connessioni attendono un thread libero: oltre, le nuove
+    vengono chiuse subito invece di accumularsi nella coda del pool.
+    """
+
+    max_workers = 32
+    max_pending = 128
+
+    def server_activate(self):
+        super().server_activate()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="graph-server")
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+        # Connessioni accodate ma non ancora prese da un thread del pool
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        if not self._slots.acquire(blocking=False):
+            self.shutdown_request(request)
+            return
+        with self._queued_lock:
+            self._queued.add(request)
+        self._pool.submit(self._process_request_thread, request, client_address)
+
+    def _process_request_thread(self, request, client_address):
+        # Come ThreadingMixIn.process_request_thread
+        with self._queued_lock:
+            if request not in self._queued:
+                # Già chiusa da server_close
+                return
+            self._queued.discard(request)
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        pool = getattr(self, "_pool", None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+            # Le richieste cancellate non arrivano mai a un thread: i loro
+            # socket vanno chiusi qui
+            with self._queued_lock:
+                queued, self._queued = self._queued, set()
+            for request in queued:
+                self.shutdown_request(request)
 
 
 class GraphServerHandler(SimpleHTTPRequestHandler):
@@ -39,21 +164,64 @@ class GraphServerHandler(SimpleHTTPRequestHandler):
 
     # Con Python 3.7+ SimpleHTTPRequestHandler accetta 'directory'
     # Se vuoi servire static anche da una cartella assets, passa directory nel partial()
-    def __init__(self, *args, graph_dir: Optional[str] = None, **kwargs):
+    def __init__(self, *args, graph_dir: Optional[str] = None,
+                 graph_dir_resolved: Optional[str] = None, **kwargs):
         self.graph_dir = Path(graph_dir or "./graphs")
+        # serve() risolve la cartella una volta sola; altrimenti si risolve qui
+        self._root_resolved = Path(graph_dir_resolved) if graph_dir_resolved else self.graph_dir.resolve()
         super().__init__(*args, **kwargs)
 
     # --------------------- util ---------------------
     def _send_json(self, status: int, obj) -> None:
-        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        self._send_json_bytes(status, _dumps(obj))
+
+    def _accepts_gzip(self) -> bool:
+        return "gzip" in self.headers.get("Accept-Encoding", "")
+
+    def _send_json_bytes(self, status: int, data: bytes, data_gz: Optional[bytes] = None) -> None:
+        # data_gz: versione già compressa di data, se disponibile
+        compressible = len(data) >= _GZIP_MIN_SIZE
+        if compressible and self._accepts_gzip():
+            data = data_gz if data_gz is not None else gzip.compress(data, 1)
+            encoding = "gzip"
+        else:
+            encoding = None
         self.send_response(status)
         self.send_header("Content-Type", "application/json; charset=utf-8")
         self.send_header("Content-Length", str(len(data)))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        if compressible:
+            self.send_header("Vary", "Accept-Encoding")
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Cache-Control", "no-store, must-revalidate")
         self.end_headers()
         self.wfile.write(data)
 
+    def _send_file(self, src, path: Path, content_type="application/json; charset=utf-8") -> None:
+        # src è il file già aperto in path: è inviato così com'è e con
+        # sendfile i dati non passano da Python
+        st = os.fstat(src.fileno())
+        if self._accepts_gzip() and st.st_size >= _GZIP_MIN_SIZE:
+            data = _gzip_file(src, path, st)
+            self._send_file_headers(content_type, len(data), "gzip")
+            self.wfile.write(data)
+            return
+        self._send_file_headers(content_type, st.st_size, None)
+        self.wfile.flush()
+        self.connection.sendfile(src, 0, st.st_size)
+
+    def _send_file_headers(self, content_type: str, size: int, encoding: Optional[str]) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(size))
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.send_header("Cache-Control", "no-store, must-revalidate")
+        self.end_headers()
+
     def _send_text(self, status: int, text: str, content_type="text/html; charset=utf-8") -> None:
         data = text.encode("utf-8")
         self.send_response(status)
@@ -64,19 +232,47 @@ class GraphServerHandler(SimpleHTTPRequestHandler):
         self.wfile.write(data)
 
     def _list_graphs(self):
+        # Un solo passaggio con scandir e una stat per file
         graphs = []
-        if self.graph_dir.exists():
-            for p in sorted(self.graph_dir.glob("*.json")):
+        try:
+            entries = os.scandir(self.graph_dir)
+        except FileNotFoundError:
+            return graphs
+        with entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                st = entry.stat()
                 graphs.append(
                     {
-                        "name": p.stem,
-                        "filename": p.name,
-                        "size": p.stat().st_size,
-                        "mtime": int(p.stat().st_mtime),
+                        "name": entry.name[:-5],
+                        "filename": entry.name,
+                        "size": st.st_size,
+                        "mtime": int(st.st_mtime),
                     }
                 )
+        graphs.sort(key=lambda g: g["filename"])
         return graphs
 
+    def _graphs_payload(self):
+        # Restituisce (payload, payload compresso o None se troppo piccolo)
+        try:
+            mtime = os.stat(self.graph_dir).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        key = str(self.graph_dir)
+        now = time.monotonic()
+        with _LIST_CACHE_LOCK:
+            if (_LIST_CACHE["dir"] == key and _LIST_CACHE["mtime"] == mtime
+                    and now - _LIST_CACHE["ts"] < _LIST_CACHE_TTL):
+                return _LIST_CACHE["payload"], _LIST_CACHE["payload_gz"]
+
+        payload = _dumps(self._list_graphs())
+        payload_gz = gzip.compress(payload, 1) if len(payload) >= _GZIP_MIN_SIZE else None
+        with _LIST_CACHE_LOCK:
+            _LIST_CACHE.update(dir=key, mtime=mtime, payload=payload, payload_gz=payload_gz, ts=now)
+        return payload, payload_gz
+
     # --------------------- CORS ---------------------
     def do_OPTIONS(self):
         self.send_response(204)
@@ -95,7 +291,7 @@ class GraphServerHandler(SimpleHTTPRequestHandler):
 
         if path == "/api/graphs":
             try:
-                return self._send_json(200, self._list_graphs())
+                return self._send_json_bytes(200, *self._graphs_payload())
             except Exception as e:
                 return self._send_json(500, {"error": f"Errore nel caricamento dei grafi: {e}"})
 
@@ -107,14 +303,24 @@ class GraphServerHandler(SimpleHTTPRequestHandler):
             f = (self.graph_dir / f"{name}.json").resolve()
             # Evita che il path esca dalla cartella
             try:
-                f.relative_to(self.graph_dir.resolve())
+                f.relative_to(self._root_resolved)
             except Exception:
                 return self._send_json(400, {"error": "Accesso non consentito"})
-            if not f.exists():
+            try:
+                # Un'unica apertura: niente exists() separato e nessuna finestra
+                # tra il controllo e la lettura
+                src = open(f, "rb")
+            except FileNotFoundError:
                 return self._send_json(404, {"error": f"Grafo {name} non trovato"})
+            except Exception as e:
+                return self._send_json(500, {"error": f"Errore nel caricamento del grafo: {e}"})
             try:
-                data = json.loads(f.read_text(encoding="utf-8"))
-                return self._send_json(200, data)
+                with src:
+                    if parse_qs(parsed.query).get("validate") == ["1"]:
+                        # Verifica che il file sia JSON valido prima di inviarlo
+                        data = json.loads(src.read().decode("utf-8"))
+                        return self._send_json(200, data)
+                    return self._send_file(src, f)
             except Exception as e:
                 return self._send_json(500, {"error": f"Errore nel caricamento del grafo: {e}"})
 
@@ -220,17 +426,19 @@ def serve(graph_file_dir: str, port: int = 8001, open_browser: bool = True, stat
     """
     root = Path(graph_file_dir)
     root.mkdir(parents=True, exist_ok=True)
+    root_resolved = root.resolve()
 
     # Se vuoi servire static anche da una cartella (es. assets), passa directory=static_dir qui.
     Handler = partial(
         GraphServerHandler,
         graph_dir=str(root),
+        graph_dir_resolved=str(root_resolved),
         directory=(static_dir if static_dir else None)
     )
 
     httpd = ThreadingHTTPServer(("0.0.0.0", port), Handler)
     print(f"🚀 Circuit Tracer Server avviato su http://localhost:{port}")
-    print(f"📁 Directory grafi: {root.resolve()}")
+    print(f"📁 Directory grafi: {root_resolved}")
     print(f"🔗 Apri http://localhost:{port} nel browser")
     print("⏹️  Ctrl+C per fermare")
 
@@ -0,0 +1,49 @@
+"""Test degli script di gestione degli archivi."""
+
+import importlib.util
+import json
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+
+
+@pytest.fixture
+def decode_silence(monkeypatch):
+    """Carica scripts/decode_silence.py sostituendo i moduli onepai che importa."""
+    stubs = {
+        "onepai.core.archive": {"TreasureArchive": object},
+        "onepai.core.crypto": {"CryptoManager": object},
+        "onepai.memory.unsaid_vault": {"UnsaidVault": object},
+    }
+    for name, attrs in stubs.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        monkeypatch.setitem(sys.modules, name, module)
+
+    spec = importlib.util.spec_from_file_location(
+        "decode_silence_under_test", SCRIPTS_DIR / "decode_silence.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": 1}',
+    '{}',
+    '{"a": 1' + ' ' * 300 + '}',
+    '{"a": 1}\n' + ' ' * 5000,
+    '{\n  "a": [1, 2]\n}\n',
+])
+def test_append_json_member_keeps_file_valid(decode_silence, tmp_path, text):
+    path = tmp_path / "treasure.json"
+    path.write_text(text, encoding="utf-8")
+
+    decode_silence._append_json_member(str(path), "metadata", {"type": "unknown"})
+
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data == {**json.loads(text), "metadata": {"type": "unknown"}}